@@ -0,0 +1,289 @@
+"""批量训练/评估环境：无界面同步运行多局游戏，观测以 NumPy 数组返回
+
+用法：
+    envs = VectorMazeEnv(64, num_workers=4)
+    obs = envs.reset(seed=0)
+    obs, rewards, terminated, truncated, infos = envs.step(actions)
+
+动作为 0~8 的整数（见 ACTIONS），结束的环境会自动重置，结束时的结果放在 infos 中。
+单进程模式下返回的数组会在下一次 step 时被原地覆盖，需要保留时请自行复制。
+"""
+import multiprocessing as mp
+import random
+
+import numpy as np
+
+from main import FRAME_MS, GAME_HEIGHT, GAME_WIDTH, MazeGenerator, ObstacleType, Simulation
+
+# 动作编号 -> 移动方向
+ACTIONS = [(0, 0), (0, -1), (1, -1), (1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1)]
+
+REWARD_VICTORY = 1.0
+REWARD_DEATH = -1.0
+
+# 栅格观测的通道顺序
+RASTER_CHANNELS = ('wall', 'swamp', 'trap', 'exit', 'enemy', 'player')
+CH_WALL, CH_SWAMP, CH_TRAP, CH_EXIT, CH_ENEMY, CH_PLAYER = range(len(RASTER_CHANNELS))
+NAV_GRID_SIZE = 20  # 与 NavGrid 默认格子大小一致
+
+
+class ObservationRenderer:
+    """把关卡状态画到网格分辨率的多通道数组 (通道, 行, 列) 中，不创建任何 Surface
+
+    静态通道（墙、沼泽、陷阱、终点）只在关卡版本变化时重画，每帧只清空并重画敌人和玩家。
+    render() 返回的是预分配数组本身，out 可以是批量观测数组中的一行（视图），从而不产生拷贝。
+    """
+
+    def __init__(self, level, out=None):
+        self.level = level
+        self.nav = level.nav_grid
+        self.shape = (len(RASTER_CHANNELS), self.nav.rows, self.nav.cols)
+        self.frame = np.zeros(self.shape, dtype=np.uint8) if out is None else out
+        # 墙壁占用网格的零拷贝视图 (行, 列)，墙壁增量更新后自动反映最新状态
+        self.walls = np.frombuffer(self.nav.blocked, dtype=np.uint8).reshape(self.nav.cols, self.nav.rows).T
+        self.static_version = None
+
+    def _cells(self, rect):
+        """rect 覆盖到的格子范围（行切片, 列切片）"""
+        size = self.nav.grid_size
+        return (slice(max(0, rect.top // size), max(0, (rect.bottom - 1) // size + 1)),
+                slice(max(0, rect.left // size), max(0, (rect.right - 1) // size + 1)))
+
+    def _render_static(self):
+        frame = self.frame
+        frame[:CH_ENEMY] = 0
+        frame[CH_WALL] = self.walls
+        for obstacle in self.level.statics:
+            if obstacle.type == ObstacleType.SWAMP:
+                frame[CH_SWAMP][self._cells(obstacle.rect)] = 1
+            elif obstacle.type == ObstacleType.TRAP:
+                frame[CH_TRAP][self._cells(obstacle.rect)] = 1
+        x, y = self.level.end_pos
+        size = self.nav.grid_size
+        frame[CH_EXIT, y // size:(y + 39) // size + 1, x // size:(x + 39) // size + 1] = 1
+        self.static_version = self.level.version
+
+    def render(self, player):
+        if self.static_version != self.level.version:
+            self._render_static()
+        frame = self.frame
+        frame[CH_ENEMY:] = 0
+        for enemy in self.level.enemies:
+            frame[CH_ENEMY][self._cells(enemy.rect)] = 1
+        frame[CH_PLAYER][self._cells(player.rect)] = 1
+        return frame
+
+    def channel(self, name):
+        """按名称取单个通道（视图）"""
+        return self.frame[RASTER_CHANNELS.index(name)]
+
+
+class MazeEnv:
+    """单局游戏环境，观测直接写入调用方提供的批量数组"""
+
+    def __init__(self, level_data=None, max_steps=3600, view_radius=5, max_enemies=8, raster=False):
+        self.level_data = level_data  # None 表示每次重置都生成随机关卡
+        self.max_steps = max_steps
+        self.view_radius = view_radius
+        self.max_enemies = max_enemies
+        self.raster = raster  # 是否输出整张地图的栅格观测
+        self.raster_out = None  # 栅格观测写入的目标数组（批量观测中的一行）
+        self.renderer = None
+        self.rng = random.Random()
+        self.sim = None
+        self.steps = 0
+        self.padded_grid = None
+
+    def reset(self, seed=None):
+        if seed is not None:
+            self.rng.seed(seed)
+        level_data = self.level_data or MazeGenerator.generate_random_level(rng=self.rng)
+        self.sim = Simulation(level_data, load_images=False)
+        self.steps = 0
+
+        # 墙壁占用网格四周补一圈墙，局部视野切片时不用再判断越界
+        nav = self.sim.level.nav_grid
+        grid = np.frombuffer(nav.blocked, dtype=np.uint8).reshape(nav.cols, nav.rows).T
+        self.padded_grid = np.pad(grid, self.view_radius, constant_values=1)
+        if self.raster:
+            self.renderer = ObservationRenderer(self.sim.level, self.raster_out)
+
+    def step(self, action):
+        """推进一步，返回 (reward, terminated, truncated, result, score)"""
+        dx, dy = ACTIONS[action]
+        self.steps += 1
+        result = self.sim.step(dx, dy, int(self.steps * FRAME_MS))
+        if result == Simulation.VICTORY:
+            reward = REWARD_VICTORY
+        elif result is not None:
+            reward = REWARD_DEATH
+        else:
+            reward = 0.0
+        truncated = result is None and self.steps >= self.max_steps
+        return reward, result is not None, truncated, result, self.sim.score
+
+    def observe(self, obs, i):
+        """把当前状态写入批量观测数组的第 i 行"""
+        player = self.sim.player
+        obs['player'][i] = player.rect.center
+        obs['health'][i] = player.health
+        obs['time'][i] = self.sim.current_time
+
+        enemies = self.sim.level.enemies[:self.max_enemies]
+        obs['enemies'][i] = 0
+        obs['enemy_mask'][i] = False
+        for j, enemy in enumerate(enemies):
+            obs['enemies'][i, j] = enemy.rect.center
+        obs['enemy_mask'][i, :len(enemies)] = True
+
+        nav = self.sim.level.nav_grid
+        cx, cy = nav.to_cell(player.rect.center)
+        size = 2 * self.view_radius + 1
+        obs['occupancy'][i] = self.padded_grid[cy:cy + size, cx:cx + size]
+        if self.renderer is not None:
+            self.renderer.render(player)  # 直接写入 obs['raster'][i]
+
+
+def make_obs_buffers(num_envs, view_radius=5, max_enemies=8, raster_shape=None):
+    """分配批量观测数组"""
+    size = 2 * view_radius + 1
+    buffers = {
+        'player': np.zeros((num_envs, 2), dtype=np.float32),
+        'health': np.zeros(num_envs, dtype=np.float32),
+        'time': np.zeros(num_envs, dtype=np.float32),
+        'enemies': np.zeros((num_envs, max_enemies, 2), dtype=np.float32),
+        'enemy_mask': np.zeros((num_envs, max_enemies), dtype=bool),
+        'occupancy': np.zeros((num_envs, size, size), dtype=np.uint8),
+    }
+    if raster_shape is not None:
+        buffers['raster'] = np.zeros((num_envs, *raster_shape), dtype=np.uint8)
+    return buffers
+
+
+class _LocalVectorEnv:
+    """在当前进程中同步运行一组环境"""
+
+    def __init__(self, num_envs, **env_kwargs):
+        self.envs = [MazeEnv(**env_kwargs) for _ in range(num_envs)]
+        first = self.envs[0]
+        raster_shape = (len(RASTER_CHANNELS), GAME_HEIGHT // NAV_GRID_SIZE, GAME_WIDTH // NAV_GRID_SIZE)
+        self.obs = make_obs_buffers(num_envs, first.view_radius, first.max_enemies,
+                                    raster_shape if first.raster else None)
+        if first.raster:
+            for i, env in enumerate(self.envs):
+                env.raster_out = self.obs['raster'][i]
+        self.rewards = np.zeros(num_envs, dtype=np.float32)
+        self.terminated = np.zeros(num_envs, dtype=bool)
+        self.truncated = np.zeros(num_envs, dtype=bool)
+
+    def reset(self, seeds):
+        for i, env in enumerate(self.envs):
+            env.reset(seeds[i])
+            env.observe(self.obs, i)
+        return self.obs
+
+    def step(self, actions):
+        results = [None] * len(self.envs)
+        scores = np.zeros(len(self.envs), dtype=np.int32)
+        for i, env in enumerate(self.envs):
+            reward, terminated, truncated, result, score = env.step(int(actions[i]))
+            self.rewards[i] = reward
+            self.terminated[i] = terminated
+            self.truncated[i] = truncated
+            if terminated or truncated:
+                results[i] = result
+                scores[i] = score
+                env.reset()
+            env.observe(self.obs, i)
+        infos = {'result': results, 'score': scores}
+        return self.obs, self.rewards, self.terminated, self.truncated, infos
+
+
+def _worker(conn, num_envs, env_kwargs):
+    envs = _LocalVectorEnv(num_envs, **env_kwargs)
+    try:
+        while True:
+            command, data = conn.recv()
+            if command == 'reset':
+                conn.send(envs.reset(data))
+            elif command == 'step':
+                conn.send(envs.step(data))
+            elif command == 'close':
+                break
+    finally:
+        conn.close()
+
+
+class VectorMazeEnv:
+    """N 局游戏同步推进；num_workers > 0 时分散到多个子进程"""
+
+    def __init__(self, num_envs, num_workers=0, **env_kwargs):
+        self.num_envs = num_envs
+        self.num_workers = min(num_workers, num_envs)
+        if not self.num_workers:
+            self.local = _LocalVectorEnv(num_envs, **env_kwargs)
+            return
+
+        self.local = None
+        self.slices = np.array_split(np.arange(num_envs), self.num_workers)
+        self.conns = []
+        self.processes = []
+        for indices in self.slices:
+            parent, child = mp.Pipe()
+            process = mp.Process(target=_worker, args=(child, len(indices), env_kwargs), daemon=True)
+            process.start()
+            child.close()
+            self.conns.append(parent)
+            self.processes.append(process)
+
+    def reset(self, seed=None):
+        seeds = [None if seed is None else seed + i for i in range(self.num_envs)]
+        if self.local:
+            return self.local.reset(seeds)
+        for conn, indices in zip(self.conns, self.slices):
+            conn.send(('reset', [seeds[i] for i in indices]))
+        return _concat_obs([conn.recv() for conn in self.conns])
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        if self.local:
+            return self.local.step(actions)
+        for conn, indices in zip(self.conns, self.slices):
+            conn.send(('step', actions[indices]))
+        parts = [conn.recv() for conn in self.conns]
+        obs = _concat_obs([part[0] for part in parts])
+        rewards, terminated, truncated = (np.concatenate([part[k] for part in parts]) for k in (1, 2, 3))
+        infos = {
+            'result': [result for part in parts for result in part[4]['result']],
+            'score': np.concatenate([part[4]['score'] for part in parts]),
+        }
+        return obs, rewards, terminated, truncated, infos
+
+    def close(self):
+        if self.local:
+            return
+        for conn in self.conns:
+            conn.send(('close', None))
+            conn.close()
+        for process in self.processes:
+            process.join()
+
+
+def _concat_obs(parts):
+    return {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+
+
+if __name__ == "__main__":
+    # 随机动作吞吐量测试
+    import time
+
+    num_envs, num_workers, steps = 256, mp.cpu_count(), 200
+    envs = VectorMazeEnv(num_envs, num_workers=num_workers)
+    envs.reset(seed=0)
+    rng = np.random.default_rng(0)
+    start = time.perf_counter()
+    for _ in range(steps):
+        envs.step(rng.integers(0, len(ACTIONS), num_envs))
+    elapsed = time.perf_counter() - start
+    envs.close()
+    print(f"{num_envs} 个环境 x {steps} 步，{num_workers} 个进程: {num_envs * steps / elapsed:.0f} 步/秒")
@@ -0,0 +1,247 @@
+"""关卡难度评估：用脚本寻路机器人在无界面模式下多次试玩关卡，统计胜率等指标
+
+用法：
+    python evaluate_levels.py                         # 评估预定义关卡和若干随机关卡
+    python evaluate_levels.py example_level.json --runs 50 --sort win_rate
+    python evaluate_levels.py --random 20 --workers 8 --csv report.csv
+"""
+import argparse
+import csv
+import heapq
+import json
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from main import FRAME_MS, Game, LevelPack, MazeGenerator, ObstacleType, Simulation
+
+MAX_TIME_MS = 60000  # 单局最长游戏时间，超时算失败
+NOISE = 0.05  # 附近没有敌人时随机乱走的概率，不同种子因此得到不同的对局
+NOISE_STEPS = 10  # 每次乱走持续的步数
+THREAT_RADIUS = 250  # 敌人在该范围内（横纵坐标差）时才考虑躲避
+LOOKAHEAD = 8  # 评估每个动作时向前预测的步数
+SAFE_GAP = 30  # 预测位置与敌人碰撞框的间隔小于该值时开始扣分
+DANGER_WEIGHT = 20  # 间隔每少 1 像素扣的分（与终点距离的像素同一量纲）
+SWAMP_COST = 2  # 寻路场中沼泽附近格子额外的代价（沼泽里速度只有三分之一）
+TRAP_COST = 4  # 陷阱附近格子额外的代价
+TIMEOUT = 'timeout'
+
+REPORT_COLUMNS = ['level', 'runs', 'win_rate', 'avg_time_s', 'avg_score', 'avg_trap_damage',
+                  'deaths_enemy', 'deaths_health', 'timeouts']
+
+
+class PathBot:
+    """沿到终点的距离场走的脚本机器人：绕开沼泽和陷阱，敌人靠近时按预测位置躲避
+
+    距离场在开局时用 Dijkstra 从终点算一次。每一步对 9 个动作各预测 LOOKAHEAD 步后的位置，
+    得分为该位置到终点的距离加上与附近敌人（假设其径直追来）过近的惩罚，取得分最低的动作。
+    """
+
+    def __init__(self, sim, rng):
+        self.sim = sim
+        self.rng = rng
+        self.nav = sim.level.nav_grid
+        player = sim.player.rect
+        self.need = self.nav.required_clearance(player.width, player.height)
+        self.field = self._distance_field(sim.end_rect.center)
+        self.steps = 0
+        self.noise_left = 0
+        self.noise_action = (0, 0)
+
+    def _distance_field(self, goal):
+        """每个格子沿可走格子到终点的代价，走不到的格子为 None"""
+        nav = self.nav
+        rows, size = nav.rows, nav.grid_size
+        extra = bytearray(nav.cols * rows)
+        margin = max(self.sim.player.rect.size)  # 玩家碰撞框与危险区域重叠前就开始计代价
+        hazards = {ObstacleType.SWAMP: SWAMP_COST, ObstacleType.TRAP: TRAP_COST}
+        for obstacle in self.sim.level.statics:
+            cost = hazards.get(obstacle.type)
+            if not cost:
+                continue
+            x0, x1, y0, y1 = nav._cell_bounds(obstacle.rect.inflate(margin, margin))
+            for x in range(x0, x1):
+                for y in range(y0, y1):
+                    extra[x * rows + y] = max(extra[x * rows + y], cost)
+
+        field = [None] * (nav.cols * rows)
+        gx, gy = nav.to_cell(goal)
+        field[gx * rows + gy] = 0
+        heap = [(0, gx, gy)]
+        while heap:
+            dist, x, y = heapq.heappop(heap)
+            if dist > field[x * rows + y]:
+                continue
+            for dx, dy in ((0, -1), (1, 0), (0, 1), (-1, 0)):
+                nx, ny = x + dx, y + dy
+                if not nav.is_walkable(nx, ny, self.need):
+                    continue
+                i = nx * rows + ny
+                cost = dist + 1 + extra[i]
+                if field[i] is None or cost < field[i]:
+                    field[i] = cost
+                    heapq.heappush(heap, (cost, nx, ny))
+        return field
+
+    def _cost(self, pos):
+        x, y = self.nav.to_cell(pos)
+        if not (0 <= x < self.nav.cols and 0 <= y < self.nav.rows):
+            return None
+        return self.field[x * self.nav.rows + y]
+
+    def act(self):
+        self.steps += 1
+        player = self.sim.player.rect
+        cx, cy = player.center
+        threats = [enemy for enemy in self.sim.level.enemies
+                   if abs(enemy.rect.centerx - cx) < THREAT_RADIUS and abs(enemy.rect.centery - cy) < THREAT_RADIUS]
+        if not threats:
+            if self.noise_left:
+                self.noise_left -= 1
+                return self.noise_action
+            if self.rng.random() < NOISE:
+                self.noise_left = NOISE_STEPS
+                self.noise_action = (self.rng.randint(-1, 1), self.rng.randint(-1, 1))
+                return self.noise_action
+
+        reach = self.sim.player.speed * LOOKAHEAD
+        best, best_score = (0, 0), None
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                pos = (cx + dx * reach, cy + dy * reach)
+                cost = self._cost(pos)
+                if cost is None:
+                    if dx or dy:
+                        continue  # 会撞墙或出界
+                    cost = self._cost(player.center) or 0
+                score = cost * self.nav.grid_size
+                for enemy in threats:
+                    score += DANGER_WEIGHT * max(0, SAFE_GAP - _gap_after_chase(player, pos, enemy))
+                if best_score is None or score < best_score:
+                    best, best_score = (dx, dy), score
+        return best
+
+
+def _gap_after_chase(player, pos, enemy):
+    """敌人朝 pos 径直追 LOOKAHEAD 步后，与站在 pos 的玩家碰撞框之间的间隔（负数表示相撞）"""
+    ex, ey = enemy.rect.center
+    vx, vy = pos[0] - ex, pos[1] - ey
+    distance = max(1, (vx ** 2 + vy ** 2) ** 0.5)
+    step = enemy.chase_speed * LOOKAHEAD
+    ex, ey = ex + vx / distance * step, ey + vy / distance * step
+    # 与 Player.check_obstacles 一致：敌人碰撞框四边各缩进 10 像素
+    return max(abs(pos[0] - ex) - (player.width + enemy.rect.width - 20) / 2,
+               abs(pos[1] - ey) - (player.height + enemy.rect.height - 20) / 2)
+
+
+def play(name, level_data, seed):
+    """试玩一局，返回该局的统计"""
+    rng = random.Random(seed)
+    sim = Simulation(level_data, load_images=False)
+    bot = PathBot(sim, rng)
+    step = 0
+    result = None
+    while result is None and step * FRAME_MS < MAX_TIME_MS:
+        step += 1
+        result = sim.step(*bot.act(), int(step * FRAME_MS))
+    return {
+        'level': name,
+        'result': result or TIMEOUT,
+        'time_ms': sim.current_time,
+        'score': sim.score,
+        'trap_damage': sim.player.max_health - sim.player.health,  # 只有陷阱会扣血
+    }
+
+
+def _play_task(task):
+    return play(*task)
+
+
+def aggregate(runs):
+    """按关卡汇总每局统计"""
+    by_level = {}
+    for run in runs:
+        by_level.setdefault(run['level'], []).append(run)
+
+    rows = []
+    for name, level_runs in by_level.items():
+        wins = [run for run in level_runs if run['result'] == Simulation.VICTORY]
+        count = len(level_runs)
+        rows.append({
+            'level': name,
+            'runs': count,
+            'win_rate': len(wins) / count,
+            'avg_time_s': sum(run['time_ms'] for run in wins) / len(wins) / 1000 if wins else None,
+            'avg_score': sum(run['score'] for run in wins) / len(wins) if wins else 0,
+            'avg_trap_damage': sum(run['trap_damage'] for run in level_runs) / count,
+            'deaths_enemy': sum(run['result'] == Simulation.DIED_ENEMY for run in level_runs),
+            'deaths_health': sum(run['result'] == Simulation.DIED_HEALTH for run in level_runs),
+            'timeouts': sum(run['result'] == TIMEOUT for run in level_runs),
+        })
+    return rows
+
+
+def evaluate(levels, runs=20, seed=0, workers=None):
+    """levels 为 [(名称, 关卡数据)]，每个关卡用不同种子试玩 runs 次，在进程池中并行"""
+    tasks = [(name, data, seed + i) for name, data in levels for i in range(runs)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_play_task, tasks, chunksize=max(1, len(tasks) // (4 * (workers or os.cpu_count())))))
+    return aggregate(results)
+
+
+def sort_report(rows, key='win_rate', reverse=False):
+    # 没有通关记录的关卡（avg_time_s 为 None）排在最后
+    return sorted(rows, key=lambda row: (row[key] is None, row[key]), reverse=reverse)
+
+
+def format_report(rows):
+    def cell(value):
+        if value is None:
+            return '-'
+        return f"{value:.2f}" if isinstance(value, float) else str(value)
+
+    table = [REPORT_COLUMNS] + [[cell(row[column]) for column in REPORT_COLUMNS] for row in rows]
+    widths = [max(len(line[i]) for line in table) for i in range(len(REPORT_COLUMNS))]
+    return '\n'.join('  '.join(value.ljust(width) for value, width in zip(line, widths)) for line in table)
+
+
+def collect_levels(paths, random_count, seed):
+    levels = [(f"关卡{i}", data) for i, data in enumerate(Game._load_predefined_levels(), start=1)] if not paths else []
+    for path in paths:
+        if path.endswith('.mzp'):
+            with LevelPack(path) as pack:
+                levels.extend((f"{os.path.basename(path)}#{i}", data) for i, data in enumerate(pack, start=1))
+            continue
+        with open(path, encoding='utf-8') as f:
+            levels.append((os.path.basename(path), json.load(f)))
+    for i in range(random_count):
+        rng = random.Random(seed + i)
+        levels.append((f"随机{seed + i}", MazeGenerator.generate_random_level(rng=rng)))
+    return levels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用脚本机器人评估关卡难度")
+    parser.add_argument('levels', nargs='*', help="关卡JSON文件或关卡包（.mzp），不指定时评估预定义关卡")
+    parser.add_argument('--random', type=int, default=5, help="额外评估的随机关卡数量")
+    parser.add_argument('--runs', type=int, default=20, help="每个关卡的试玩次数")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help="进程数，默认等于CPU核数")
+    parser.add_argument('--sort', default='win_rate', choices=REPORT_COLUMNS)
+    parser.add_argument('--reverse', action='store_true', help="降序排列")
+    parser.add_argument('--csv', help="同时把报告写入CSV文件")
+    args = parser.parse_args()
+
+    levels = collect_levels(args.levels, args.random, args.seed)
+    rows = sort_report(evaluate(levels, args.runs, args.seed, args.workers), args.sort, args.reverse)
+    print(format_report(rows))
+
+    if args.csv:
+        with open(args.csv, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    main()
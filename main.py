@@ -1,11 +1,23 @@
+import hashlib
+import io
+import mmap
+import struct
+import threading
+import time
+import zlib
+from array import array
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import os
 import pygame
 import json
 import random
-from enum import Enum
+from enum import Enum, IntEnum
 
-# 初始化pygame
-pygame.init()
+PROCESS_START = time.perf_counter()  # 用于统计启动耗时
+
+# pygame 子系统按需初始化（见 Game.__init__ 和 AssetLoader），导入本模块不再有副作用
 
 # 游戏常量
 WINDOW_WIDTH = 1300
@@ -17,7 +29,83 @@ UI_WIDTH = 200
 ENEMY_WIDTH = 50
 ENEMY_HEIGHT = 40
 
-start_time = pygame.time.get_ticks()
+STARTUP_TARGET_MS = 200  # 首帧目标耗时
+MENU_PLAYER_SIZE = (120, 120)  # 菜单动画中的玩家图片尺寸
+MENU_ENEMY_SIZE = (120, 75)  # 菜单动画中的敌人图片尺寸
+MUSIC_FADE_MS = 600  # 切歌时淡出/淡入的时长
+FRAME_MS = 1000 / 60  # 逻辑固定步长：每个 tick 对应的游戏时间，有界面和无界面运行一致
+MAX_TICKS_PER_FRAME = 5  # 每个渲染帧最多补几个 tick，逻辑跟不上时丢弃积压时间，防止越追越卡
+MAX_RENDER_FPS = 144  # 未开启垂直同步时的渲染帧率上限（基准模式不限制）
+SPRITE_CACHE_DIR = 'image_cache'  # 烘焙后的图片缓存目录
+SPRITE_BAKE_VERSION = 1  # 处理流程变化时加一，旧的缓存自动失效
+SPRITE_HEADER = struct.Struct('<4sHHB')  # 魔数、宽、高、每像素字节数（3=RGB，4=RGBA），后接像素数据
+SPRITE_MAGIC = b'MZSP'
+# 图片路径（相对于运行目录）
+PLAYER_LEFT_IMAGE = os.path.join('image', 'player_left.png')
+PLAYER_RIGHT_IMAGE = os.path.join('image', 'player_right.png')
+ENEMY_LEFT_IMAGE = os.path.join('image', 'enemy_left.png')
+ENEMY_RIGHT_IMAGE = os.path.join('image', 'enemy_right.png')
+MENU_BACKGROUND_IMAGE = os.path.join('image', 'menu_background.jpg')
+# 关卡中用到的精灵图片：(路径, 尺寸, 饱和度增强系数)，启动时在后台线程预加载
+GAMEPLAY_SPRITES = [
+    (PLAYER_LEFT_IMAGE, (60, 60), 3),
+    (PLAYER_RIGHT_IMAGE, (60, 60), 3),
+    (ENEMY_LEFT_IMAGE, (ENEMY_WIDTH, ENEMY_HEIGHT), None),
+    (ENEMY_RIGHT_IMAGE, (ENEMY_WIDTH, ENEMY_HEIGHT), None),
+]
+# 需要预先烘焙的图片；关卡里其他尺寸的敌人首次使用时再烘焙
+SPRITE_BAKES = GAMEPLAY_SPRITES + [
+    (MENU_BACKGROUND_IMAGE, (WINDOW_WIDTH, WINDOW_HEIGHT), None),
+    (PLAYER_RIGHT_IMAGE, MENU_PLAYER_SIZE, None),
+    (ENEMY_RIGHT_IMAGE, MENU_ENEMY_SIZE, None),
+]
+
+LEVEL_PACK_PATH = 'levels.mzp'  # 存在时菜单和关卡编号使用该关卡包，否则使用内置关卡
+LEVEL_PACK_MAGIC = b'MZLP'
+LEVEL_PACK_VERSION = 1
+LEVEL_PACK_ZLIB = 0x01  # 关卡数据经过 zlib 压缩
+# 关卡包文件头：魔数、版本、标志、关卡数、索引偏移；索引为每关 (偏移, 长度)，位于所有关卡数据之后
+LEVEL_PACK_HEADER = struct.Struct('<4sHBIQ')
+LEVEL_PACK_ENTRY = struct.Struct('<QI')
+LEVEL_CACHE_SIZE = 16  # 解码后的关卡数据最多缓存几关
+
+STATS_REPORT_MS = 1000  # 帧率和寻路统计的汇总间隔（基准模式输出到控制台，遥测 DEBUG 级别写入事件）
+
+REWIND_HISTORY_TICKS = 300  # 回退缓冲区保存的 tick 数（5 秒）
+REWIND_TICKS = 120  # 每按一次回退键退回的 tick 数（2 秒）
+QUICKSAVE_PATH = 'quicksave.bin'
+QUICKSAVE_MAGIC = b'MZQS'
+
+# 快照二进制格式（小端、无填充）：
+# 头部：关卡内时间（毫秒）、AI 帧号、得分、结果、玩家坐标、血量、是否在沼泽、敌人数
+SNAPSHOT_HEADER = struct.Struct('<IIiBhhfBH')
+# 每个敌人：坐标、巡逻路径下标、AI层级、下次更新帧号、上次寻路时间、朝向（1=左）、追击路径点数、巡逻路线点数，
+# 后接追击路径点和巡逻路线点各 SNAPSHOT_PATH_POINTS 个（未用到的位置内容无意义）
+SNAPSHOT_ENEMY = struct.Struct('<hhHBIIBBB')
+SNAPSHOT_POINT = struct.Struct('<hh')
+# 追击路径每 bfs_update_interval（50 毫秒，约 3 个 tick）重算一次，每个 tick 最多用掉一个点，
+# 重算前用到的点不超过 4 个，所以只保存前 8 个点也能精确复现
+SNAPSHOT_PATH_POINTS = 8
+# 存档文件头：魔数、关卡编号、关卡JSON长度、快照长度
+QUICKSAVE_HEADER = struct.Struct('<4sIII')
+
+TELEMETRY_DIR = 'telemetry'  # 遥测事件的 JSONL 文件目录
+TELEMETRY_FILE = 'events.jsonl'
+TELEMETRY_MAX_BYTES = 1 << 20  # 单个文件超过该大小时轮转
+TELEMETRY_BACKUPS = 5  # 保留的历史文件数 events.jsonl.1 ~ .5
+TELEMETRY_FLUSH_S = 1.0  # 后台线程写盘间隔
+TELEMETRY_BATCH = 256  # 队列积压到这么多条时提前唤醒后台线程
+TELEMETRY_QUEUE_MAX = 100000  # 队列上限，写盘跟不上时丢弃最旧的事件
+
+# 敌人AI细节层次（LOD）参数：进入和退出的距离不同，形成滞回，避免在边界来回切换
+LOD_ACTIVE_ENTER = 350  # 小于该距离升为追击层（需大于追击范围）
+LOD_ACTIVE_EXIT = 450  # 大于该距离降为巡逻层
+LOD_SLEEP_ENTER = 900  # 大于该距离降为休眠层
+LOD_SLEEP_EXIT = 750  # 小于该距离从休眠层唤醒
+LOD_PATROL_INTERVAL = 4  # 巡逻层每隔几帧更新一次
+LOD_SLEEP_INTERVAL = 30  # 休眠层每隔几帧检查一次距离
+
+SPATIAL_CELL_SIZE = 100  # 静态障碍物空间哈希的桶大小
 
 # 颜色定义
 BLACK = (0, 0, 0)
@@ -33,6 +121,14 @@ DARK_GREEN = (0, 128, 0)
 ORANGE = (255, 165, 0)
 
 
+# 遥测日志级别
+class LogLevel(IntEnum):
+    DEBUG = 10  # 按键、帧时间、寻路统计等高频事件
+    INFO = 20  # 关卡开始、死亡、胜利等
+    WARNING = 30
+    OFF = 100
+
+
 # 游戏状态
 class GameState(Enum):
     MENU = 1
@@ -50,8 +146,16 @@ class ObstacleType(Enum):
     ENEMY = 4
 
 
+# 敌人AI层级
+class AiLod(Enum):
+    ACTIVE = 1  # 每帧完整追击逻辑
+    PATROL = 2  # 低频沿巡逻路径移动
+    SLEEP = 3  # 不移动，只低频检查是否需要唤醒
+
+
+@lru_cache(maxsize=None)
 def load_chinese_font(size):
-    """加载支持中文的字体"""
+    """加载支持中文的字体（按字号缓存，SysFont 查找很慢）"""
     chinese_fonts = 'SimHei'
     font = pygame.font.SysFont(chinese_fonts, size)
     return font
@@ -63,8 +167,402 @@ def play_background_music(music_path, loop=-1, volume=0.5):
     pygame.mixer.music.set_volume(volume)
 
 
+@lru_cache(maxsize=None)
+def _source_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()[:16]
+
+
+def _sprite_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def baked_path(path, size, saturation=None):
+    """缓存文件名由源文件内容哈希、尺寸和效果参数决定，源图片或参数变化后自然不再命中"""
+    effect = 'raw' if saturation is None else f"sat{saturation}"
+    return os.path.join(SPRITE_CACHE_DIR, f"{_sprite_name(path)}-{_source_hash(path)}-{size[0]}x{size[1]}"
+                                          f"-{effect}-v{SPRITE_BAKE_VERSION}.bin")
+
+
+def _read_baked(cache_path, size):
+    try:
+        with open(cache_path, 'rb') as f:
+            data = f.read()
+        magic, width, height, depth = SPRITE_HEADER.unpack_from(data)
+    except (OSError, struct.error):
+        return None
+    pixels = memoryview(data)[SPRITE_HEADER.size:]
+    if magic != SPRITE_MAGIC or (width, height) != tuple(size) or depth not in (3, 4) \
+            or len(pixels) != width * height * depth:
+        return None  # 文件损坏或被截断，重新处理
+    return pygame.image.frombuffer(pixels, (width, height), 'RGBA' if depth == 4 else 'RGB')
+
+
+def _write_baked(cache_path, image):
+    """写入缓存（先写临时文件再改名，不会留下半个文件）；写不了就算了，下次运行再处理"""
+    depth = 4 if image.get_flags() & pygame.SRCALPHA else 3
+    pixels = pygame.image.tobytes(image, 'RGBA' if depth == 4 else 'RGB')
+    try:
+        os.makedirs(SPRITE_CACHE_DIR, exist_ok=True)
+        temp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(SPRITE_HEADER.pack(SPRITE_MAGIC, *image.get_size(), depth))
+            f.write(pixels)
+        os.replace(temp_path, cache_path)
+    except OSError:
+        pass
+
+
+def process_image(path, size, saturation=None):
+    """实时处理：加载、缩放，saturation 不为 None 时增强饱和度"""
+    image = pygame.transform.scale(pygame.image.load(path), size)
+    if saturation is not None:
+        image = enhance_color_saturation(image, saturation)
+    return image
+
+
+def load_baked_image(path, size, saturation=None):
+    """优先读取烘焙好的图片，缓存缺失或无效时实时处理并写入缓存
+
+    返回未 convert 的 Surface，可以在后台线程调用。
+    """
+    cache_path = baked_path(path, size, saturation)
+    image = _read_baked(cache_path, size)
+    if image is None:
+        image = process_image(path, size, saturation)
+        _write_baked(cache_path, image)
+    return image
+
+
+def bake_sprites(specs=SPRITE_BAKES):
+    """离线烘焙 specs 中的全部图片，返回新生成的文件数
+
+    同时删除这些源图片过期的缓存（源文件已修改或处理流程版本已变），
+    运行时烘焙的其他尺寸只要仍然有效就保留。
+    """
+    hashes = {}  # 图片名 -> 源文件当前的哈希
+    baked = 0
+    for path, size, saturation in specs:
+        hashes[_sprite_name(path)] = _source_hash(path)
+        cache_path = baked_path(path, size, saturation)
+        if _read_baked(cache_path, size) is None:
+            _write_baked(cache_path, process_image(path, size, saturation))
+            baked += 1
+    if os.path.isdir(SPRITE_CACHE_DIR):
+        version = f"v{SPRITE_BAKE_VERSION}.bin"
+        for name in os.listdir(SPRITE_CACHE_DIR):
+            parts = name.rsplit('-', 4)  # 图片名、哈希、尺寸、效果、版本
+            if len(parts) == 5 and parts[0] in hashes and (parts[1] != hashes[parts[0]] or parts[4] != version):
+                os.remove(os.path.join(SPRITE_CACHE_DIR, name))
+    return baked
+
+
+_preloaded_sprites = {}  # (路径, 尺寸, 饱和度) -> 后台线程加载好、尚未 convert 的 Surface
+
+
+def load_gameplay_sprites():
+    """加载关卡用到的精灵图片（不 convert，可以在后台线程调用）"""
+    return {spec: load_baked_image(*spec) for spec in GAMEPLAY_SPRITES}
+
+
+def load_sprite(path, size, saturation=None):
+    """加载精灵图片（优先使用后台预加载的结果，其次是烘焙缓存）并转换为显示格式；同一组参数只处理一次
+
+    返回的 Surface 被所有对象共用，只能用于绘制，不要修改。需在主线程、显示模式设置之后调用。
+    """
+    # 统一参数形式后再查缓存，省略饱和度或传入列表尺寸时与 GAMEPLAY_SPRITES 预热的是同一项
+    return _load_sprite(path, tuple(size), saturation)
+
+
+@lru_cache(maxsize=None)
+def _load_sprite(path, size, saturation):
+    image = _preloaded_sprites.pop((path, size, saturation), None)
+    if image is None:
+        image = load_baked_image(path, size, saturation)
+    return image.convert_alpha()
+
+
+class AssetLoader:
+    """在后台线程预加载资源，结果通过 future 获取"""
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='assets')
+        self.futures = {}
+
+    def submit(self, name, func, *args):
+        self.futures[name] = self.executor.submit(func, *args)
+        return self.futures[name]
+
+    def ready(self, name):
+        return self.futures[name].done()
+
+    def get(self, name):
+        return self.futures[name].result()
+
+    def wait_all(self):
+        for future in self.futures.values():
+            future.result()
+
+    def when_all_done(self, callback):
+        """所有已提交的任务完成后在后台线程调用 callback"""
+        self.executor.submit(callback)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class Telemetry:
+    """结构化事件遥测：游戏循环只把事件追加到内存队列，由后台线程批量写入轮转的 JSONL 文件
+
+    deque 的 append/popleft 在 GIL 下是原子操作，生产者（游戏循环）和唯一的消费者（写盘线程）
+    之间不需要加锁。低于 level 的事件在入口处直接返回；高频事件的调用方应先判断 debug_on，
+    连参数都不构造。带 msg 字段且不低于 console_level 的事件同时由后台线程输出到控制台。
+    """
+
+    def __init__(self, level=LogLevel.INFO, directory=TELEMETRY_DIR, console_level=LogLevel.INFO,
+                 max_bytes=TELEMETRY_MAX_BYTES, backups=TELEMETRY_BACKUPS, flush_interval=TELEMETRY_FLUSH_S):
+        self.level = level
+        self.debug_on = level <= LogLevel.DEBUG
+        self.console_level = console_level
+        self.path = os.path.join(directory, TELEMETRY_FILE)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.queue = deque(maxlen=TELEMETRY_QUEUE_MAX)
+        self.wake = threading.Event()
+        self.stopping = False
+        self.file = None
+        self.thread = None
+        if level < LogLevel.OFF:
+            os.makedirs(directory, exist_ok=True)
+            self.file = open(self.path, 'a', encoding='utf-8')
+            self.thread = threading.Thread(target=self._run, name='telemetry', daemon=True)
+            self.thread.start()
+            self.info('session_start', pid=os.getpid())
+
+    def log(self, severity, event, /, **fields):
+        if severity < self.level:
+            return
+        self.queue.append((time.time(), severity, event, fields))
+        if len(self.queue) == TELEMETRY_BATCH:
+            self.wake.set()
+
+    def debug(self, event, /, **fields):
+        if self.debug_on:
+            self.queue.append((time.time(), LogLevel.DEBUG, event, fields))
+
+    def info(self, event, /, **fields):
+        self.log(LogLevel.INFO, event, **fields)
+
+    def warning(self, event, /, **fields):
+        self.log(LogLevel.WARNING, event, **fields)
+
+    def _run(self):
+        while not self.stopping:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        """取出队列中的全部事件写盘（只在后台线程或关闭时调用）"""
+        lines = []
+        queue = self.queue
+        while queue:
+            ts, severity, event, fields = queue.popleft()
+            record = {'ts': round(ts, 3), 'severity': severity.name.lower(), 'event': event}
+            record.update(fields)
+            lines.append(json.dumps(record, ensure_ascii=False, default=str))
+            if 'msg' in fields and severity >= self.console_level:
+                print(fields['msg'])
+        if not lines:
+            return
+        self.file.write('\n'.join(lines) + '\n')
+        self.file.flush()
+        if self.file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self.file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        if self.thread is None:
+            return
+        self.info('session_end')
+        self.stopping = True
+        self.wake.set()
+        self.thread.join()
+        self.thread = None
+        self.file.close()
+
+
+def load_fonts():
+    """预加载游戏界面用到的所有字号"""
+    return {size: load_chinese_font(size) for size in (100, 40, 36, 24, 18, 15)}
+
+
+def load_menu_images():
+    """加载缩放好的菜单图片（优先使用烘焙缓存），convert 留给主线程"""
+    background = load_baked_image(MENU_BACKGROUND_IMAGE, (WINDOW_WIDTH, WINDOW_HEIGHT))
+    player_img = load_baked_image(PLAYER_RIGHT_IMAGE, MENU_PLAYER_SIZE)
+    enemy_img = load_baked_image(ENEMY_RIGHT_IMAGE, MENU_ENEMY_SIZE)
+    return background, player_img, enemy_img
+
+
+class MusicManager:
+    """背景音乐管理：启动时校验播放列表，后台线程预读下一首，切歌不阻塞主循环
+
+    主循环每帧调用 update()：当前曲目淡出结束且新曲目数据已读入内存后才真正切换，
+    因此按键处理中不会出现文件读取或解码。
+    """
+
+    def __init__(self, music_list, volume=0.5, fade_ms=MUSIC_FADE_MS, telemetry=None):
+        self.music_list = music_list
+        self.telemetry = telemetry if telemetry is not None else Telemetry(LogLevel.OFF)
+        self.volume = volume
+        self.fade_ms = fade_ms
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='music')
+        self.cache = {}  # 曲目索引 -> 读取文件内容的 future
+        self.current_index = None  # 正在播放的曲目
+        self.pending_index = None  # 等待切换的曲目
+        self.request_time = 0.0
+        self.stream = None  # 正在播放的内存数据，播放期间必须保持引用
+        self.latencies = []  # 每次切歌从按键到开始播放的耗时（毫秒）
+        self.prefetch_hits = 0
+        self.prefetch_misses = 0
+        self.lock = threading.RLock()  # start() 在后台线程调用，与主循环的 update() 互斥
+        self.valid_indices = self.validate()
+
+    def validate(self):
+        """检查播放列表中的文件是否存在，缺失的曲目在切歌时跳过"""
+        valid = []
+        for i, path in enumerate(self.music_list):
+            if os.path.isfile(path):
+                valid.append(i)
+            else:
+                self.telemetry.warning('music_missing', path=path, msg=f"音乐文件不存在，已跳过: {path}")
+        return valid
+
+    @property
+    def available(self):
+        return pygame.mixer.get_init() is not None and bool(self.valid_indices)
+
+    def start(self, index=0):
+        """初始化音频并播放第一首可用曲目（在后台线程调用）"""
+        try:
+            pygame.mixer.init()
+        except pygame.error as e:
+            self.telemetry.warning('audio_init_failed', error=str(e), msg=f"音频初始化失败: {e}")
+            return False
+        if not self.valid_indices:
+            return False
+        if index not in self.valid_indices:
+            index = self.valid_indices[0]
+        self.switch(index)
+        return True
+
+    def _read(self, index):
+        with open(self.music_list[index], 'rb') as f:
+            return f.read()
+
+    def prefetch(self, index):
+        """在后台读取曲目文件，已在读取或已缓存则直接返回"""
+        if index not in self.cache:
+            self.cache[index] = self.executor.submit(self._read, index)
+        return self.cache[index]
+
+    def next_index(self, index=None):
+        """播放列表中 index 之后的下一首可用曲目"""
+        if not self.valid_indices:
+            return None
+        if index is None:
+            index = self.current_index if self.pending_index is None else self.pending_index
+        later = [i for i in self.valid_indices if index is not None and i > index]
+        return later[0] if later else self.valid_indices[0]
+
+    def switch(self, index):
+        """请求切换到指定曲目，立即返回"""
+        if not self.available or index not in self.valid_indices:
+            return False
+        with self.lock:
+            if self.cache.get(index) is not None and self.cache[index].done():
+                self.prefetch_hits += 1
+            else:
+                self.prefetch_misses += 1
+            self.prefetch(index)
+            self.pending_index = index
+            self.request_time = time.perf_counter()
+            if pygame.mixer.music.get_busy():
+                pygame.mixer.music.fadeout(self.fade_ms)
+            self.update()
+        return True
+
+    def update(self):
+        """每帧调用：淡出完成且数据就绪后开始播放等待中的曲目"""
+        if self.pending_index is None or pygame.mixer.get_init() is None:
+            return
+        with self.lock:
+            self._play_pending()
+
+    def _play_pending(self):
+        if self.pending_index is None:
+            return
+        future = self.cache[self.pending_index]
+        if not future.done() or pygame.mixer.music.get_busy():
+            return
+
+        index = self.pending_index
+        self.pending_index = None
+        try:
+            self.stream = io.BytesIO(future.result())
+            pygame.mixer.music.load(self.stream, os.path.splitext(self.music_list[index])[1].lstrip('.'))
+            pygame.mixer.music.play(loops=-1, fade_ms=self.fade_ms)
+            pygame.mixer.music.set_volume(self.volume)
+        except (OSError, pygame.error) as e:
+            self.telemetry.warning('music_failed', path=self.music_list[index], error=str(e),
+                                   msg=f"音乐播放失败: {self.music_list[index]} ({e})")
+            self.valid_indices.remove(index)
+            del self.cache[index]
+            return
+        self.current_index = index
+        self.latencies.append((time.perf_counter() - self.request_time) * 1000)
+
+        # 只保留当前曲目和下一首的数据
+        upcoming = self.next_index(index)
+        for cached in list(self.cache):
+            if cached not in (index, upcoming):
+                del self.cache[cached]
+        if upcoming is not None:
+            self.prefetch(upcoming)
+
+    def set_volume(self, volume):
+        self.volume = volume
+        if pygame.mixer.get_init() is not None:
+            pygame.mixer.music.set_volume(volume)
+
+    def metrics(self):
+        """切歌延迟统计（毫秒）和预读命中情况"""
+        latencies = self.latencies or [0.0]
+        return {
+            'switches': len(self.latencies),
+            'last_ms': latencies[-1],
+            'avg_ms': sum(latencies) / len(latencies),
+            'max_ms': max(latencies),
+            'prefetch_hits': self.prefetch_hits,
+            'prefetch_misses': self.prefetch_misses,
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
 class Player:
-    def __init__(self, x, y, size=60):
+    def __init__(self, x, y, size=60, load_images=True):
         self.speed = 3
         self.health = 100
         self.max_health = 100
@@ -74,17 +572,17 @@ class Player:
 
         self.invincible = False  # 无敌状态
         self.invincible_time = 0  # 无敌时间
-        # 加载玩家图片
-        self.image_left = pygame.image.load(".\image\player_left.png").convert_alpha()
-        self.image_left = pygame.transform.scale(self.image_left, (self.size, self.size))  # 缩放图片
-        self.image_left = enhance_color_saturation(self.image_left, 3)
-
-        self.image_right = pygame.image.load(".\image\player_right.png").convert_alpha()
-        self.image_right = pygame.transform.scale(self.image_right, (self.size, self.size))  # 缩放图片
-        self.image_right = enhance_color_saturation(self.image_right, 3)
-
-        self.image = self.image_right
-        self.rect = self.image.get_rect(topleft=(x, y))  # 使用 rect 管理位置
+        self.rect = pygame.Rect(x, y, size, size)  # 使用 rect 管理位置
+        # 无界面模式（训练、评估、后台预构建）不加载图片，只保留碰撞矩形
+        self.image = self.image_left = self.image_right = None
+        if load_images:
+            self.attach_images()
+
+    def attach_images(self):
+        """加载玩家图片（缩放并增强饱和度，结果按参数缓存），需在主线程调用"""
+        self.image_left = load_sprite(PLAYER_LEFT_IMAGE, (self.size, self.size), 3)
+        self.image_right = load_sprite(PLAYER_RIGHT_IMAGE, (self.size, self.size), 3)
+        self.image = self.image_right if self.direction >= 0 else self.image_left
 
     def move(self, dx, dy, obstacles):
         speed = self.speed // 2 if self.in_swamp else self.speed
@@ -162,20 +660,289 @@ class Player:
 
         # 显示无敌时间倒计时
         if self.invincible:
-            remaining_time = max(0, 2000 - (pygame.time.get_ticks() - start_time)) // 100
+            remaining_time = max(0, 2000 - self.invincible_time) // 100
             font = load_chinese_font(15)
             text = font.render(f"无敌: {remaining_time / 10:.1f}s", True, (0, 0, 0))
             screen.blit(text, (self.rect.x, self.rect.y - 20))
 
 
+class NavGrid:
+    """墙壁占用网格：关卡加载时构建一次，供视线检测和寻路共用"""
+
+    def __init__(self, obstacles, grid_size=20, width=GAME_WIDTH, height=GAME_HEIGHT):
+        self.grid_size = grid_size
+        self.cols = width // grid_size
+        self.rows = height // grid_size
+        self.blocked = bytearray(self.cols * self.rows)  # 按 x * rows + y 存储，1 表示墙
+        self.wall_count = array('H', bytes(2 * self.cols * self.rows))  # 覆盖每个格子的墙壁数，墙壁可以重叠
+        self.version = 0  # 网格每次变化加一，供寻路缓存判断是否过期
+        self.listeners = []  # 网格变化时的回调 listener(version, region)
+        self.stats = None  # 设为 {'searches', 'failed', 'ms'} 计数字典时统计寻路次数和耗时
+        for obstacle in obstacles:
+            if obstacle.type == ObstacleType.WALL:
+                self._mark(obstacle.rect, 1)
+        # 每个格子到最近墙壁（含地图边界）的切比雪夫距离，单位为格子，墙壁本身为0
+        self.clearance = bytearray(self.cols * self.rows)
+        self._compute_clearance(0, self.cols, 0, self.rows)
+
+    def _cell_bounds(self, rect):
+        # 与原先逐次构建网格时的标记范围保持一致
+        start_x = max(0, rect.left // self.grid_size)
+        end_x = min(self.cols, rect.right // self.grid_size + 1)
+        start_y = max(0, rect.top // self.grid_size)
+        end_y = min(self.rows, rect.bottom // self.grid_size + 1)
+        return start_x, end_x, start_y, end_y
+
+    def _mark(self, rect, delta):
+        start_x, end_x, start_y, end_y = self._cell_bounds(rect)
+        for x in range(start_x, end_x):
+            base = x * self.rows
+            for y in range(start_y, end_y):
+                count = self.wall_count[base + y] + delta
+                self.wall_count[base + y] = count
+                self.blocked[base + y] = 1 if count else 0
+
+    def _compute_clearance(self, x0, x1, y0, y1):
+        """两遍扫描的距离变换，窗口外的格子视为已知值
+
+        关卡加载时对整张地图算一次，之后墙壁变化只重算受影响的窗口。
+        """
+        cols, rows = self.cols, self.rows
+        dist = self.clearance
+        limit = 255
+        for x in range(x0, x1):
+            base = x * rows
+            for y in range(y0, y1):
+                dist[base + y] = 0 if self.blocked[base + y] else limit
+
+        # 正向扫描：左、左上、左下、上
+        for x in range(x0, x1):
+            base = x * rows
+            for y in range(y0, y1):
+                i = base + y
+                if not dist[i]:
+                    continue
+                best = dist[i - 1] if y > 0 else 0
+                if x > 0:
+                    prev = i - rows
+                    best = min(best, dist[prev], dist[prev - 1] if y > 0 else 0,
+                               dist[prev + 1] if y < rows - 1 else 0)
+                else:
+                    best = 0  # 地图边界视为墙
+                dist[i] = min(dist[i], best + 1)
+
+        # 反向扫描：右、右上、右下、下
+        for x in range(x1 - 1, x0 - 1, -1):
+            base = x * rows
+            for y in range(y1 - 1, y0 - 1, -1):
+                i = base + y
+                if not dist[i]:
+                    continue
+                best = dist[i + 1] if y < rows - 1 else 0
+                if x < cols - 1:
+                    nxt = i + rows
+                    best = min(best, dist[nxt], dist[nxt - 1] if y > 0 else 0,
+                               dist[nxt + 1] if y < rows - 1 else 0)
+                else:
+                    best = 0
+                dist[i] = min(dist[i], best + 1)
+
+    def update_walls(self, added=(), removed=()):
+        """增量更新墙壁：只改动受影响的格子和净空窗口，返回变化区域（世界坐标）"""
+        rects = list(added) + list(removed)
+        if not rects:
+            return None
+        # 净空可能变化的格子离改动格子不超过改动前的最大净空
+        margin = max(self.clearance)
+        for rect in removed:
+            self._mark(rect, -1)
+        for rect in added:
+            self._mark(rect, 1)
+
+        bounds = [self._cell_bounds(rect) for rect in rects]
+        start_x = min(b[0] for b in bounds)
+        end_x = max(b[1] for b in bounds)
+        start_y = min(b[2] for b in bounds)
+        end_y = max(b[3] for b in bounds)
+        self._compute_clearance(max(0, start_x - margin), min(self.cols, end_x + margin),
+                                max(0, start_y - margin), min(self.rows, end_y + margin))
+
+        self.version += 1
+        size = self.grid_size
+        region = pygame.Rect(start_x * size, start_y * size, (end_x - start_x) * size, (end_y - start_y) * size)
+        for listener in self.listeners:
+            listener(self.version, region)
+        return region
+
+    def required_clearance(self, width, height):
+        """体型为 width x height 的角色中心所在格子需要的最小净空"""
+        half_extent = max(width, height) / 2
+        # 净空为 d 时，以格子中心为中心可容纳的半宽为 (d - 1) * grid_size + grid_size / 2
+        need = 1
+        while (need - 1) * self.grid_size + self.grid_size / 2 < half_extent:
+            need += 1
+        return need
+
+    def to_cell(self, pos):
+        return int(pos[0]) // self.grid_size, int(pos[1]) // self.grid_size
+
+    def to_world(self, cell):
+        half = self.grid_size // 2
+        return cell[0] * self.grid_size + half, cell[1] * self.grid_size + half
+
+    def is_walkable(self, x, y, min_clearance=1):
+        return 0 <= x < self.cols and 0 <= y < self.rows and self.clearance[x * self.rows + y] >= min_clearance
+
+    def line_of_sight(self, start, end, min_clearance=1):
+        """网格DDA射线检测：start到end之间经过的格子净空都足够则返回True
+
+        起点和终点格子只要求不是墙，角色贴墙站立时仍能判定视线。
+        """
+        size = self.grid_size
+        x0, y0 = start[0] / size, start[1] / size
+        x1, y1 = end[0] / size, end[1] / size
+        cx, cy = int(x0), int(y0)
+        end_cx, end_cy = int(x1), int(y1)
+        if not self.is_walkable(cx, cy) or not self.is_walkable(end_cx, end_cy):
+            return False
+
+        dx, dy = x1 - x0, y1 - y0
+        step_x = 1 if dx > 0 else -1
+        step_y = 1 if dy > 0 else -1
+        inf = float('inf')
+        t_delta_x = abs(1 / dx) if dx else inf
+        t_delta_y = abs(1 / dy) if dy else inf
+        t_max_x = ((cx + 1 - x0) if dx > 0 else (x0 - cx)) * t_delta_x if dx else inf
+        t_max_y = ((cy + 1 - y0) if dy > 0 else (y0 - cy)) * t_delta_y if dy else inf
+
+        remaining = abs(end_cx - cx) + abs(end_cy - cy)  # 最多需要跨越的格子数，防止浮点误差越界
+        while remaining > 0:
+            if t_max_x < t_max_y:
+                t_max_x += t_delta_x
+                cx += step_x
+                remaining -= 1
+            elif t_max_y < t_max_x:
+                t_max_y += t_delta_y
+                cy += step_y
+                remaining -= 1
+            else:
+                # 正好穿过格子角点：两侧相邻格子都要检查，防止从墙角缝隙穿过
+                if (not self.is_walkable(cx + step_x, cy, min_clearance)
+                        or not self.is_walkable(cx, cy + step_y, min_clearance)):
+                    return False
+                t_max_x += t_delta_x
+                t_max_y += t_delta_y
+                cx += step_x
+                cy += step_y
+                remaining -= 2
+            if remaining > 0 and not self.is_walkable(cx, cy, min_clearance):
+                return False
+        return True
+
+    def find_path(self, start, goal, min_clearance=1):
+        """BFS寻路：只走净空足够的格子（终点格子只要求不是墙），返回平滑后的拐点"""
+        if self.stats is None:
+            return self._bfs(start, goal, min_clearance)
+        began = time.perf_counter()
+        path = self._bfs(start, goal, min_clearance)
+        stats = self.stats
+        stats['searches'] += 1
+        stats['failed'] += not path
+        stats['ms'] += (time.perf_counter() - began) * 1000
+        return path
+
+    def _bfs(self, start, goal, min_clearance):
+        grid_rows = self.rows
+        start_x, start_y = self.to_cell(start)
+        end_x, end_y = self.to_cell(goal)
+        clearance = self.clearance
+
+        # BFS算法
+        queue = deque()
+        queue.append((start_x, start_y))
+        visited = bytearray(self.cols * grid_rows)
+        parent = {}
+        directions = [(0, -1), (1, 0), (0, 1), (-1, 0), (1, 1), (-1, -1), (1, -1), (-1, 1)]  # 上右下左
+
+        while queue:
+            x, y = queue.popleft()
+            if (x, y) == (end_x, end_y):
+                # 回溯路径
+                cells = []
+                while (x, y) != (start_x, start_y):
+                    cells.append((x, y))
+                    x, y = parent[(x, y)]
+                cells.reverse()
+                # 压缩成拐点，避免每20像素一个路点
+                return self.smooth_path(start, cells, min_clearance)
+
+            for dx, dy in directions:
+                nx, ny = x + dx, y + dy
+                if not (0 <= nx < self.cols and 0 <= ny < grid_rows):
+                    continue
+                i = nx * grid_rows + ny
+                if visited[i]:
+                    continue
+                if clearance[i] >= min_clearance or (clearance[i] and (nx, ny) == (end_x, end_y)):
+                    visited[i] = 1
+                    parent[(nx, ny)] = (x, y)
+                    queue.append((nx, ny))
+
+        return deque()  # 无路径
+
+    def smooth_path(self, start, cells, min_clearance=1):
+        """拉绳平滑：把逐格路径压缩成少量拐点（世界坐标）"""
+        path = deque()
+        anchor = start
+        last_visible = None
+        for cell in cells:
+            point = self.to_world(cell)
+            if last_visible is not None and not self.line_of_sight(anchor, point, min_clearance):
+                path.append(last_visible)
+                anchor = last_visible
+            last_visible = point
+        if last_visible is not None:
+            path.append(last_visible)
+        return path
+
+
 class Obstacle:
-    def __init__(self, x, y, width, height, obstacle_type):
+    """障碍物的位置和类型；关卡中的静态障碍物存放在 StaticObstacles 里，这里只是按需构造的视图
+
+    row 为该障碍物在 StaticObstacles 中的行号，不属于任何关卡时为 None。
+    """
+    __slots__ = ('rect', 'type', 'row')
+
+    COLOR_MAP = {
+        ObstacleType.WALL: GRAY,
+        ObstacleType.SWAMP: DARK_GREEN,
+        ObstacleType.TRAP: RED,
+        ObstacleType.ENEMY: PURPLE
+    }
+
+    def __init__(self, x, y, width, height, obstacle_type, row=None):
         self.rect = pygame.Rect(x, y, width, height)
         self.type = obstacle_type
+        self.row = row
 
-        self.image = None
-        self.image_right = None
-        self.image_left = None
+    @property
+    def color(self):
+        return self.COLOR_MAP.get(self.type, BLACK)
+
+    def draw(self, screen):
+        pygame.draw.rect(screen, self.color, self.rect)
+
+
+class Enemy(Obstacle):
+    """会巡逻和追击玩家的敌人"""
+    __slots__ = ('image', 'image_right', 'image_left', 'direction',
+                 'grid_size', 'bfs_path', 'last_bfs_update', 'bfs_update_interval',
+                 'chase_range', 'chase_speed', 'in_swamp', 'swap_speed', 'speed',
+                 'path', 'path_index', 'move_speed', 'original_x', 'original_y',
+                 'lod', 'next_ai_tick', 'patrol_route')
+
+    def __init__(self, x, y, width=ENEMY_WIDTH, height=ENEMY_HEIGHT, load_images=True):
+        super().__init__(x, y, width, height, ObstacleType.ENEMY)
 
         self.grid_size = 20  # 寻路网格大小
         self.bfs_path = deque()  # BFS计算出的路径
@@ -187,95 +954,39 @@ class Obstacle:
         self.swap_speed = 1.0
         self.speed = 2.0
 
-        # 敌人特有属性
-        if obstacle_type == ObstacleType.ENEMY:
-            self.path = []
-            self.path_index = 0
-            self.move_speed = 1
-            self.original_x = x
-            self.original_y = y
-
-            self.image_left = pygame.image.load(".\image\enemy_left.png").convert_alpha()
-            self.image_left = pygame.transform.scale(self.image_left, (width, height))  # 缩放图片
-
-            self.image_right = pygame.image.load(".\image\enemy_right.png").convert_alpha()
-            self.image_right = pygame.transform.scale(self.image_right, (width, height))
-
-            self.image = self.image_right  # 默认向右
-            self.direction = 1  # 1=右，-1=左
-        else:
-            self.color = self._get_color()  # 其他类型使用颜色
-
-    def _get_color(self):
-        color_map = {
-            ObstacleType.WALL: GRAY,
-            ObstacleType.SWAMP: DARK_GREEN,
-            ObstacleType.TRAP: RED,
-            ObstacleType.ENEMY: PURPLE
-        }
-        return color_map.get(self.type, BLACK)
+        self.path = []
+        self.path_index = 0
+        self.patrol_route = deque()  # 当前巡逻段绕墙的拐点（中心坐标），走完即到达下一个巡逻点
+        self.move_speed = 1
+        self.original_x = x
+        self.original_y = y
+        self.lod = AiLod.PATROL
+        self.next_ai_tick = 0  # 下一次需要处理该敌人的帧号
+        self.direction = 1  # 1=右，-1=左
+        self.image = self.image_left = self.image_right = None
+        if load_images:
+            self.attach_images()
+
+    def attach_images(self):
+        """加载敌人图片（按尺寸缓存，同尺寸的敌人共用），需在主线程调用"""
+        self.image_left = load_sprite(ENEMY_LEFT_IMAGE, self.rect.size)
+        self.image_right = load_sprite(ENEMY_RIGHT_IMAGE, self.rect.size)
+        self.image = self.image_right  # 默认向右
 
     def calculate_bfs_path(self, game_map, player_pos, obstacles):
-        grid_cols = GAME_WIDTH // self.grid_size
-        grid_rows = GAME_HEIGHT // self.grid_size
-        grid = [[True for _ in range(grid_rows)] for _ in range(grid_cols)]
-
-        # 正确标记障碍物（只考虑墙壁）
-        for obstacle in obstacles:
-            if obstacle.type == ObstacleType.WALL:
-                start_x = obstacle.rect.left // self.grid_size
-                end_x = (obstacle.rect.right // self.grid_size) + 1
-                start_y = obstacle.rect.top // self.grid_size
-                end_y = (obstacle.rect.bottom // self.grid_size) + 1
-
-                for x in range(start_x, min(end_x, grid_cols)):
-                    for y in range(start_y, min(end_y, grid_rows)):
-                        if 0 <= x < grid_cols and 0 <= y < grid_rows:
-                            grid[x][y] = False
-
-        # 坐标转换（修复）
-        start_x = self.rect.centerx // self.grid_size
-        start_y = self.rect.centery // self.grid_size
-        end_x = player_pos[0] // self.grid_size
-        end_y = player_pos[1] // self.grid_size
-
-        # BFS算法（修正队列操作）
-        queue = deque()
-        queue.append((start_x, start_y))  # 修复语法
-        visited = [[False] * grid_rows for _ in range(grid_cols)]
-        parent = [[None] * grid_rows for _ in range(grid_cols)]
-        directions = [(0, -1), (1, 0), (0, 1), (-1, 0), (1, 1), (-1, -1), (1, -1), (-1, 1)]  # 上右下左
-
-        while queue:
-            x, y = queue.popleft()
-            if (x, y) == (end_x, end_y):
-                # 回溯路径（修复坐标转换）
-                path = deque()
-                while (x, y) != (start_x, start_y):
-                    # 转换为世界坐标（网格中心点）
-                    world_x = x * self.grid_size + self.grid_size // 2
-                    world_y = y * self.grid_size + self.grid_size // 2
-                    path.appendleft((world_x, world_y))
-                    x, y = parent[x][y]
-                return path
-
-            for dx, dy in directions:
-                nx, ny = x + dx, y + dy
-                if (0 <= nx < grid_cols and 0 <= ny < grid_rows
-                        and grid[nx][ny] and not visited[nx][ny]):
-                    visited[nx][ny] = True
-                    parent[nx][ny] = (x, y)
-                    queue.append((nx, ny))  # 修复语法
-
-        return deque()  # 无路径
-
-    def update(self, game_map=None, player=None, obstacles=None):
-        if self.type == ObstacleType.ENEMY and self.path:
-            current_time = pygame.time.get_ticks()
+        # game_map 为关卡预先构建的 NavGrid；未提供时才临时构建
+        nav = game_map if game_map is not None else NavGrid(obstacles, self.grid_size)
+        return nav.find_path(self.rect.center, player_pos, nav.required_clearance(self.rect.width, self.rect.height))
+
+    def update(self, game_map=None, player=None, obstacles=None, now=None, query=None):
+        """query 为关卡的空间哈希查询函数，提供时只检查附近的障碍物，否则遍历 obstacles"""
+        if self.path:
+            current_time = pygame.time.get_ticks() if now is None else now
             # 检查与SWAMP类型障碍物的碰撞并减速
             self.in_swamp = False
-            if obstacles:
-                for obstacle in obstacles:
+            nearby = query(self.rect) if query is not None else obstacles
+            if nearby:
+                for obstacle in nearby:
                     if obstacle.type == ObstacleType.SWAMP and self.rect.colliderect(obstacle.rect):
                         self.in_swamp = True
                         # self.speed = self.chase_speed * 0.5  # 只对SWAMP类型减速50%
@@ -293,8 +1004,13 @@ class Obstacle:
 
                 # 追击玩家
                 if dist_to_player < self.chase_range:
+                    # 视线畅通时直接追击，跳过寻路
+                    if game_map is not None and game_map.line_of_sight(
+                            self.rect.center, player.rect.center,
+                            game_map.required_clearance(self.rect.width, self.rect.height)):
+                        self.bfs_path.clear()
                     # 定期更新BFS路径
-                    if current_time - self.last_bfs_update > self.bfs_update_interval or not self.bfs_path:
+                    elif current_time - self.last_bfs_update > self.bfs_update_interval or not self.bfs_path:
                         self.bfs_path = self.calculate_bfs_path(game_map, player.rect.center, obstacles)
                         self.last_bfs_update = current_time
 
@@ -347,36 +1063,301 @@ class Obstacle:
             elif dx < 0:
                 self.image = self.image_left
 
+    def update_lod(self, dist_to_player):
+        """根据与玩家的距离调整AI层级（带滞回）"""
+        if self.lod == AiLod.ACTIVE:
+            if dist_to_player > LOD_ACTIVE_EXIT:
+                self.lod = AiLod.PATROL
+        elif dist_to_player < LOD_ACTIVE_ENTER:
+            self.lod = AiLod.ACTIVE
+        elif self.lod == AiLod.PATROL:
+            if dist_to_player > LOD_SLEEP_ENTER:
+                self.lod = AiLod.SLEEP
+        elif dist_to_player < LOD_SLEEP_EXIT:
+            self.lod = AiLod.PATROL
+
+    def plan_patrol_leg(self, game_map, goal):
+        """规划到下一个巡逻点的路线：视线畅通时直线前往，否则按体型寻路绕开墙壁"""
+        if game_map is None:
+            return deque([goal])
+        clearance = game_map.required_clearance(self.rect.width, self.rect.height)
+        if not game_map.is_walkable(*game_map.to_cell(goal), clearance):
+            return deque()  # 站在巡逻点上会压到墙
+        if game_map.line_of_sight(self.rect.center, goal, clearance):
+            return deque([goal])
+        route = game_map.find_path(self.rect.center, goal, clearance)
+        if route:
+            route[-1] = goal  # 寻路终点是格子中心，最后一段对准巡逻点本身
+        return route
+
+    def patrol(self, ticks=1, game_map=None):
+        """沿巡逻路径前进 ticks 帧的距离，提供 game_map 时绕开墙壁"""
+        if not self.path:
+            return
+        target_x, target_y = self.path[self.path_index]
+        goal = (target_x + self.rect.width // 2, target_y + self.rect.height // 2)
+        if not self.patrol_route:
+            self.patrol_route = self.plan_patrol_leg(game_map, goal)
+            if not self.patrol_route:
+                # 巡逻点不可达或离墙太近，跳过它
+                self.path_index = (self.path_index + 1) % len(self.path)
+                return
+
+        route = self.patrol_route
+        step = self.move_speed * ticks
+        while route and step > 0:
+            dx = route[0][0] - self.rect.centerx
+            dy = route[0][1] - self.rect.centery
+            distance = (dx ** 2 + dy ** 2) ** 0.5
+            if distance <= step:
+                self.rect.center = route.popleft()
+                step -= distance
+            else:
+                self.rect.x += round(dx / distance * step)
+                self.rect.y += round(dy / distance * step)
+                step = 0
+
+            if dx > 0:
+                self.image = self.image_right
+            elif dx < 0:
+                self.image = self.image_left
+
+        # 路线走完但没到巡逻点（快照只保存了前几个拐点），下次从当前位置重新规划
+        if not route and self.rect.center == goal:
+            self.path_index = (self.path_index + 1) % len(self.path)
+
+    def update_ai(self, tick, game_map=None, player=None, obstacles=None, now=None, query=None):
+        """按AI层级调度敌人更新，远处的敌人降频或休眠"""
+        if tick < self.next_ai_tick:
+            return
+        dx = player.rect.centerx - self.rect.centerx
+        dy = player.rect.centery - self.rect.centery
+        self.update_lod((dx ** 2 + dy ** 2) ** 0.5)
+
+        if self.lod == AiLod.ACTIVE:
+            self.next_ai_tick = tick + 1
+            if dx ** 2 + dy ** 2 < self.chase_range ** 2:
+                self.update(game_map, player, obstacles, now, query)
+            else:
+                self.patrol(game_map=game_map)
+        elif self.lod == AiLod.PATROL:
+            self.next_ai_tick = tick + LOD_PATROL_INTERVAL
+            self.patrol(LOD_PATROL_INTERVAL, game_map)
+        else:
+            self.next_ai_tick = tick + LOD_SLEEP_INTERVAL
+
+    def invalidate_path(self, region):
+        """寻路网格在 region 内发生变化时，丢弃穿过该区域的缓存路径"""
+        # 按体型扩大区域，贴着新墙走的路径同样需要重算
+        region = region.inflate(self.rect.width, self.rect.height)
+        if self._route_crosses(self.bfs_path, region):
+            self.bfs_path.clear()
+            self.last_bfs_update = 0
+        if self._route_crosses(self.patrol_route, region):
+            self.patrol_route.clear()
+
+    def _route_crosses(self, route, region):
+        start = self.rect.center
+        for point in route:
+            if region.clipline(start, point):
+                return True
+            start = point
+        return False
+
     def set_patrol_path(self, path):
         """设置敌人巡逻路径"""
-        if self.type == ObstacleType.ENEMY:
-            self.path = path
-            self.path_index = 0
+        self.path = path
+        self.patrol_route.clear()
+        self.path_index = 0
 
     def draw(self, screen):
-        if self.type == ObstacleType.ENEMY and self.image:
+        if self.image:
             screen.blit(self.image, self.rect)
         else:
-            pygame.draw.rect(screen, self.color, self.rect)
+            super().draw(screen)
+
+
+class StaticObstacles:
+    """静态障碍物（墙壁、沼泽、陷阱）按行存放在定长数组里，每行 x、y、宽、高、类型共 17 字节
+
+    大关卡有十万以上的格子，不为每个障碍物创建对象和 Rect；需要时由 obstacle(row) 临时构造视图。
+    移除的行类型置 0，之后加入的障碍物复用这些行，行号因此在关卡内保持不变。
+    """
+
+    COLORS = {obstacle_type.value: color for obstacle_type, color in Obstacle.COLOR_MAP.items()}
+
+    def __init__(self):
+        self.coords = array('i')  # 每行 4 个：x, y, 宽, 高
+        self.types = array('B')  # ObstacleType 的值，0 表示该行已移除
+        self.free = []  # 可复用的行号
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, x, y, width, height, obstacle_type):
+        """加入一个障碍物，返回行号"""
+        if self.free:
+            row = self.free.pop()
+            self.coords[4 * row:4 * row + 4] = array('i', (x, y, width, height))
+            self.types[row] = obstacle_type.value
+        else:
+            row = len(self.types)
+            self.coords.extend((x, y, width, height))
+            self.types.append(obstacle_type.value)
+        self.count += 1
+        return row
+
+    def remove(self, row):
+        self.types[row] = 0
+        self.free.append(row)
+        self.count -= 1
+
+    def move(self, row, x, y):
+        self.coords[4 * row] = x
+        self.coords[4 * row + 1] = y
+
+    def rect(self, row):
+        i = 4 * row
+        return pygame.Rect(self.coords[i], self.coords[i + 1], self.coords[i + 2], self.coords[i + 3])
+
+    def obstacle(self, row):
+        i = 4 * row
+        return Obstacle(self.coords[i], self.coords[i + 1], self.coords[i + 2], self.coords[i + 3],
+                        ObstacleType(self.types[row]), row)
+
+    def rows(self):
+        """所有有效的行号"""
+        return (row for row, obstacle_type in enumerate(self.types) if obstacle_type)
+
+    def __iter__(self):
+        for row in self.rows():
+            yield self.obstacle(row)
+
+    def draw(self, screen):
+        coords = self.coords
+        for row in self.rows():
+            pygame.draw.rect(screen, self.COLORS[self.types[row]], coords[4 * row:4 * row + 4])
 
 
 class Level:
-    def __init__(self, level_data):
+    def __init__(self, level_data, load_images=True):
+        self.load_images = load_images
         self.start_pos = level_data.get('start', (50, 50))
         self.end_pos = level_data.get('end', (GAME_WIDTH - 100, GAME_HEIGHT - 100))
-        self.obstacles = []
+        self.statics = StaticObstacles()  # 墙壁、沼泽、陷阱
+        self.enemies = []
         self._load_obstacles(level_data.get('obstacles', []))
+        self.nav_grid = NavGrid(self.statics)  # 寻路网格只在加载时构建一次，之后增量更新
+        self.nav_grid.listeners.append(self._on_nav_changed)
+        self.version = 0  # 静态障碍物（墙、沼泽、陷阱）每次变化加一，供缓存判断是否过期
+        self.ai_tick = 0
+
+        # 静态障碍物的空间哈希：桶 -> 行号数组，碰撞检测只查询附近的桶
+        self.buckets = {}
+        for row in self.statics.rows():
+            self._bucket_insert(row, self.statics.rect(row))
+
+        # 错开各敌人的首次更新帧，避免低频更新集中在同一帧
+        for i, enemy in enumerate(self.enemies):
+            enemy.next_ai_tick = i % LOD_PATROL_INTERVAL
+
+    @property
+    def obstacles(self):
+        """全部障碍物（静态障碍物为临时视图），只用于加载、绘制等不频繁的遍历"""
+        return list(self.statics) + self.enemies
 
     def _load_obstacles(self, obstacle_data):
         for obs in obstacle_data:
             obstacle_type = ObstacleType(obs['type'])
-            obstacle = Obstacle(obs['x'], obs['y'], obs['width'], obs['height'], obstacle_type)
-
-            # 如果是敌人，设置巡逻路径
-            if obstacle_type == ObstacleType.ENEMY and 'path' in obs:
-                obstacle.set_patrol_path(obs['path'])
-
-            self.obstacles.append(obstacle)
+            if obstacle_type == ObstacleType.ENEMY:
+                enemy = Enemy(obs['x'], obs['y'], obs['width'], obs['height'], self.load_images)
+                # 设置巡逻路径
+                if 'path' in obs:
+                    enemy.set_patrol_path(obs['path'])
+                self.enemies.append(enemy)
+            else:
+                self.statics.add(obs['x'], obs['y'], obs['width'], obs['height'], obstacle_type)
+
+    def _bucket_keys(self, rect):
+        x0, x1 = rect.left // SPATIAL_CELL_SIZE, (rect.right - 1) // SPATIAL_CELL_SIZE
+        y0, y1 = rect.top // SPATIAL_CELL_SIZE, (rect.bottom - 1) // SPATIAL_CELL_SIZE
+        return [(bx, by) for bx in range(x0, x1 + 1) for by in range(y0, y1 + 1)]
+
+    def _bucket_insert(self, row, rect):
+        for key in self._bucket_keys(rect):
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = array('I')
+            bucket.append(row)
+
+    def _bucket_remove(self, row, rect):
+        for key in self._bucket_keys(rect):
+            bucket = self.buckets.get(key)
+            if bucket and row in bucket:
+                bucket.remove(row)
+                if not bucket:
+                    del self.buckets[key]
+
+    def query(self, rect):
+        """返回与 rect 所在桶相交的静态障碍物视图（可能包含不相交的，调用方自行判断碰撞）"""
+        found = {}
+        for key in self._bucket_keys(rect):
+            for row in self.buckets.get(key, ()):
+                found[row] = None
+        return [self.statics.obstacle(row) for row in found]
+
+    def add_obstacle(self, obstacle):
+        """运行时加入障碍物，只更新受影响的格子和桶；静态障碍物写入 statics，obstacle.row 指向该行"""
+        if obstacle.type == ObstacleType.ENEMY:
+            self.enemies.append(obstacle)
+            return obstacle
+        obstacle.row = self.statics.add(*obstacle.rect, obstacle.type)
+        self._bucket_insert(obstacle.row, obstacle.rect)
+        self.version += 1
+        if obstacle.type == ObstacleType.WALL:
+            self.nav_grid.update_walls(added=[obstacle.rect])
+        return obstacle
+
+    def remove_obstacle(self, obstacle):
+        """运行时移除障碍物（例如被摧毁的墙），obstacle 可以是 query() 返回的视图"""
+        if obstacle.type == ObstacleType.ENEMY:
+            self.enemies.remove(obstacle)
+            return
+        rect = self.statics.rect(obstacle.row)
+        self._bucket_remove(obstacle.row, rect)
+        self.statics.remove(obstacle.row)
+        obstacle.row = None
+        self.version += 1
+        if obstacle.type == ObstacleType.WALL:
+            self.nav_grid.update_walls(removed=[rect])
+
+    def move_obstacle(self, obstacle, x, y):
+        """运行时移动障碍物（例如移动门），新旧位置合并为一次网格更新"""
+        if obstacle.type == ObstacleType.ENEMY:
+            obstacle.rect.topleft = (x, y)
+            return
+        old_rect = self.statics.rect(obstacle.row)
+        self._bucket_remove(obstacle.row, old_rect)
+        self.statics.move(obstacle.row, x, y)
+        obstacle.rect.topleft = (x, y)
+        self._bucket_insert(obstacle.row, obstacle.rect)
+        self.version += 1
+        if obstacle.type == ObstacleType.WALL:
+            self.nav_grid.update_walls(added=[obstacle.rect], removed=[old_rect])
+
+    def _on_nav_changed(self, version, region):
+        for enemy in self.enemies:
+            enemy.invalidate_path(region)
+
+    def update_enemies(self, player, now=None):
+        """更新所有敌人，开销主要取决于玩家附近的敌人数量；now 为关卡内时间（毫秒）
+
+        沼泽检测通过空间哈希只查询敌人所在的桶，与关卡障碍物总数无关。
+        """
+        for enemy in self.enemies:
+            enemy.update_ai(self.ai_tick, self.nav_grid, player, now=now, query=self.query)
+        self.ai_tick += 1
 
     def draw(self, screen):
         # 绘制起点
@@ -388,14 +1369,16 @@ class Level:
         pygame.draw.rect(screen, BLACK, (*self.end_pos, 40, 40), 2)
 
         # 绘制障碍物
-        for obstacle in self.obstacles:
-            obstacle.draw(screen)
+        self.statics.draw(screen)
+        for enemy in self.enemies:
+            enemy.draw(screen)
 
 
 class MazeGenerator:
     @staticmethod
-    def generate_random_level(width=GAME_WIDTH, height=GAME_HEIGHT):
-        """生成随机关卡"""
+    def generate_random_level(width=GAME_WIDTH, height=GAME_HEIGHT, rng=None):
+        """生成随机关卡，rng 为 random.Random 实例时可按种子复现"""
+        rng = rng or random
         level_data = {
             'start': (20, 20),
             'end': (width - 60, height - 60),
@@ -420,10 +1403,10 @@ class MazeGenerator:
 
         # 生成随机墙壁
         while len(level_data['obstacles']) < 15:
-            x = random.randint(0, width - 100)
-            y = random.randint(0, height - 50)
-            w = random.randint(20, 100)
-            h = random.randint(20, 50)
+            x = rng.randint(0, width - 100)
+            y = rng.randint(0, height - 50)
+            w = rng.randint(20, 100)
+            h = rng.randint(20, 50)
             new_obstacle = {
                 'x': x, 'y': y, 'width': w, 'height': h, 'type': 1
             }
@@ -433,8 +1416,8 @@ class MazeGenerator:
 
         # 生成沼泽
         while len([obs for obs in level_data['obstacles'] if obs['type'] == 2]) < 8:
-            x = random.randint(0, width - 80)
-            y = random.randint(0, height - 80)
+            x = rng.randint(0, width - 80)
+            y = rng.randint(0, height - 80)
             new_obstacle = {
                 'x': x, 'y': y, 'width': 60, 'height': 60, 'type': 2
             }
@@ -444,8 +1427,8 @@ class MazeGenerator:
 
         # 生成陷阱
         while len([obs for obs in level_data['obstacles'] if obs['type'] == 3]) < 10:
-            x = random.randint(0, width - 30)
-            y = random.randint(0, height - 30)
+            x = rng.randint(0, width - 30)
+            y = rng.randint(0, height - 30)
             new_obstacle = {
                 'x': x, 'y': y, 'width': 25, 'height': 25, 'type': 3
             }
@@ -455,8 +1438,8 @@ class MazeGenerator:
 
         # 生成移动敌人
         while len([obs for obs in level_data['obstacles'] if obs['type'] == 4]) < 4:
-            x = random.randint(100, width - 200)
-            y = random.randint(100, height - 200)
+            x = rng.randint(100, width - 200)
+            y = rng.randint(100, height - 200)
             path = [(x, y), (x + 100, y), (x + 100, y + 50), (x, y + 50)]
             new_obstacle = {
                 'x': x, 'y': y, 'width': ENEMY_WIDTH, 'height': ENEMY_HEIGHT, 'type': 4, 'path': path
@@ -468,8 +1451,328 @@ class MazeGenerator:
         return level_data
 
 
-class Game:
+class LevelPack:
+    """关卡包：按编号随机访问的关卡容器，文件通过 mmap 映射，只在用到某一关时才解码
+
+    pack[i] 读索引中的一项后解码对应的数据，最近用过的 LEVEL_CACHE_SIZE 关保留解码结果；
+    iter(pack) 按顺序流式解码，不进缓存，供批量处理的工具使用。解码结果是共用的，不要修改。
+    """
+
+    def __init__(self, path, cache_size=LEVEL_CACHE_SIZE):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, self.flags, self.count, self.index_offset = LEVEL_PACK_HEADER.unpack_from(self.map)
+        except struct.error:
+            self.map.close()
+            raise ValueError(f"{path} 不是关卡包")
+        if magic != LEVEL_PACK_MAGIC or version != LEVEL_PACK_VERSION \
+                or self.index_offset + self.count * LEVEL_PACK_ENTRY.size > len(self.map):
+            self.map.close()
+            raise ValueError(f"{path} 不是关卡包或版本不受支持")
+        self.get = lru_cache(maxsize=cache_size)(self._decode)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return self.get(index)
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self._decode(index)
+
+    def raw(self, index):
+        """第 index 关未解码的数据"""
+        offset, length = LEVEL_PACK_ENTRY.unpack_from(self.map, self.index_offset + index * LEVEL_PACK_ENTRY.size)
+        data = self.map[offset:offset + length]
+        return zlib.decompress(data) if self.flags & LEVEL_PACK_ZLIB else data
+
+    def _decode(self, index):
+        return json.loads(self.raw(index))
+
+    def close(self):
+        self.get.cache_clear()
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @staticmethod
+    def write(path, levels, compress=True):
+        """把关卡数据流式写入关卡包，levels 可以是生成器；返回写入的关卡数
+
+        先写临时文件再改名，levels 中途出错时原来的文件保持不变，也不会留下只有文件头的半个关卡包。
+        """
+        flags = LEVEL_PACK_ZLIB if compress else 0
+        entries = array('Q')
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(bytes(LEVEL_PACK_HEADER.size))  # 先占位，写完索引后回填
+                for level_data in levels:
+                    data = json.dumps(level_data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+                    if compress:
+                        data = zlib.compress(data)
+                    entries.extend((f.tell(), len(data)))
+                    f.write(data)
+                index_offset = f.tell()
+                count = len(entries) // 2
+                for i in range(count):
+                    f.write(LEVEL_PACK_ENTRY.pack(entries[2 * i], entries[2 * i + 1]))
+                f.seek(0)
+                f.write(LEVEL_PACK_HEADER.pack(LEVEL_PACK_MAGIC, LEVEL_PACK_VERSION, flags, count, index_offset))
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return count
+
+
+class Simulation:
+    """单局游戏的逻辑部分（移动、敌人、碰撞、胜负判定），不涉及绘制和键盘
+
+    Game 按固定步长每个 tick 调用一次 step()；训练环境和评估工具也直接使用它在无界面模式下运行。
+    """
+    INVINCIBLE_MS = 2000  # 开局无敌时间
+    DIED_ENEMY = 'enemy'
+    DIED_HEALTH = 'health'
+    VICTORY = 'victory'
+
+    RESULT_CODES = (None, DIED_ENEMY, DIED_HEALTH, VICTORY)  # 快照中结果的编码
+
+    def __init__(self, level_data, load_images=True):
+        self.level_data = level_data
+        self.level = Level(level_data, load_images)
+        self.player = Player(*self.level.start_pos, load_images=load_images)
+        self.end_rect = pygame.Rect(*self.level.end_pos, 40, 40)
+        self.current_time = 0
+        self.score = 0
+        self.result = None  # None 表示进行中
+        self.prev_positions = None  # 上一 tick 玩家和敌人的位置，用于渲染插值
+
+    def step(self, dx, dy, current_time):
+        """推进到关卡内时间 current_time（毫秒），dx/dy 为本 tick 移动方向，返回结果"""
+        if self.result is not None:
+            return self.result
+        player = self.player
+        self.prev_positions = [player.rect.topleft] + [enemy.rect.topleft for enemy in self.level.enemies]
+        if dx != 0 or dy != 0:
+            reach = player.speed * 2
+            nearby = self.level.query(player.rect.inflate(reach * 2, reach * 2))
+            player.move(dx, dy, nearby)
+
+        self.current_time = current_time
+        player.invincible = current_time <= self.INVINCIBLE_MS
+        player.invincible_time = current_time  # 记录无敌时间用于闪烁效果
+        # 更新敌人（按距离分层调度）
+        self.level.update_enemies(player, current_time)
+
+        if current_time <= self.INVINCIBLE_MS:
+            return None
+
+        # 检查玩家与障碍物的碰撞
+        if not player.invincible and player.check_obstacles(self.level.enemies + self.level.query(player.rect)):
+            self.result = self.DIED_ENEMY
+
+        # 检查生命值
+        if player.health <= 0:
+            self.result = self.DIED_HEALTH
+
+        # 检查是否到达终点
+        if player.rect.colliderect(self.end_rect):
+            # 计算得分
+            time_bonus = max(0, 30000 - current_time) // 100
+            health_bonus = int(player.health * 10)
+            self.score = time_bonus + health_bonus
+            self.result = self.VICTORY
+        return self.result
+
+    def attach_images(self):
+        """给无图片构建的对局加上图片（后台预构建的关卡在主线程换上前调用）"""
+        self.level.load_images = True
+        self.player.attach_images()
+        for enemy in self.level.enemies:
+            enemy.attach_images()
+
+    def is_solvable(self):
+        """玩家按自身体型能否走到终点"""
+        nav = self.level.nav_grid
+        need = nav.required_clearance(self.player.rect.width, self.player.rect.height)
+        return bool(nav.find_path(self.player.rect.center, self.end_rect.center, need))
+
+    def interpolate(self, alpha):
+        """把玩家和敌人临时移到上一 tick 与当前 tick 之间 alpha 处，返回恢复用的当前位置"""
+        bodies = [self.player] + self.level.enemies
+        if self.prev_positions is None or len(self.prev_positions) != len(bodies):
+            return None
+        current = [body.rect.topleft for body in bodies]
+        for body, (px, py), (cx, cy) in zip(bodies, self.prev_positions, current):
+            body.rect.topleft = (round(px + (cx - px) * alpha), round(py + (cy - py) * alpha))
+        return current
+
+    def restore_positions(self, current):
+        for body, pos in zip([self.player] + self.level.enemies, current):
+            body.rect.topleft = pos
+
+    def snapshot_size(self):
+        enemy_size = SNAPSHOT_ENEMY.size + SNAPSHOT_POINT.size * SNAPSHOT_PATH_POINTS * 2
+        return SNAPSHOT_HEADER.size + enemy_size * len(self.level.enemies)
+
+    def write_snapshot(self, buffer, offset=0):
+        """把当前状态写入 buffer[offset:]，不分配新对象
+
+        静态障碍物不在快照中（由关卡数据决定）；敌人缓存的追击路径和巡逻路线各保存前
+        SNAPSHOT_PATH_POINTS 个点，恢复后与原来的对局逐 tick 一致。
+        """
+        player = self.player
+        enemies = self.level.enemies
+        SNAPSHOT_HEADER.pack_into(buffer, offset, self.current_time, self.level.ai_tick, self.score,
+                                  self.RESULT_CODES.index(self.result), player.rect.x, player.rect.y,
+                                  player.health, player.in_swamp, len(enemies))
+        offset += SNAPSHOT_HEADER.size
+        for enemy in enemies:
+            points = min(len(enemy.bfs_path), SNAPSHOT_PATH_POINTS)
+            route_points = min(len(enemy.patrol_route), SNAPSHOT_PATH_POINTS)
+            SNAPSHOT_ENEMY.pack_into(buffer, offset, enemy.rect.x, enemy.rect.y, enemy.path_index,
+                                     enemy.lod.value, enemy.next_ai_tick, enemy.last_bfs_update,
+                                     enemy.image is not None and enemy.image is enemy.image_left,
+                                     points, route_points)
+            offset += SNAPSHOT_ENEMY.size
+            for route, count in ((enemy.bfs_path, points), (enemy.patrol_route, route_points)):
+                for i in range(count):
+                    SNAPSHOT_POINT.pack_into(buffer, offset + i * SNAPSHOT_POINT.size, *route[i])
+                offset += SNAPSHOT_POINT.size * SNAPSHOT_PATH_POINTS
+
+    def read_snapshot(self, buffer, offset=0):
+        """从 write_snapshot 写出的数据恢复状态，快照必须来自同一关卡"""
+        (current_time, ai_tick, score, result, x, y, health, in_swamp,
+         enemy_count) = SNAPSHOT_HEADER.unpack_from(buffer, offset)
+        enemies = self.level.enemies
+        if enemy_count != len(enemies):
+            raise ValueError(f"快照中有 {enemy_count} 个敌人，当前关卡有 {len(enemies)} 个")
+        offset += SNAPSHOT_HEADER.size
+
+        self.current_time = current_time
+        self.level.ai_tick = ai_tick
+        self.score = score
+        self.result = self.RESULT_CODES[result]
+        self.prev_positions = None
+        player = self.player
+        player.rect.topleft = (x, y)
+        player.health = health
+        player.in_swamp = bool(in_swamp)
+        player.invincible = current_time <= self.INVINCIBLE_MS
+        player.invincible_time = current_time
+        for enemy in enemies:
+            x, y, path_index, lod, next_ai_tick, last_bfs_update, facing_left, points, route_points = \
+                SNAPSHOT_ENEMY.unpack_from(buffer, offset)
+            offset += SNAPSHOT_ENEMY.size
+            enemy.rect.topleft = (x, y)
+            enemy.path_index = path_index
+            enemy.lod = AiLod(lod)
+            enemy.next_ai_tick = next_ai_tick
+            enemy.last_bfs_update = last_bfs_update
+            enemy.bfs_path = deque(SNAPSHOT_POINT.iter_unpack(buffer[offset:offset + SNAPSHOT_POINT.size * points]))
+            offset += SNAPSHOT_POINT.size * SNAPSHOT_PATH_POINTS
+            enemy.patrol_route = deque(
+                SNAPSHOT_POINT.iter_unpack(buffer[offset:offset + SNAPSHOT_POINT.size * route_points]))
+            offset += SNAPSHOT_POINT.size * SNAPSHOT_PATH_POINTS
+            enemy.image = enemy.image_left if facing_left else enemy.image_right
+
+    def snapshot(self):
+        buffer = bytearray(self.snapshot_size())
+        self.write_snapshot(buffer)
+        return bytes(buffer)
+
+
+class SnapshotRing:
+    """预分配的快照环形缓冲区：每个 tick 写入一条，写满后覆盖最旧的"""
+
+    def __init__(self, capacity, snapshot_size):
+        self.capacity = capacity
+        self.snapshot_size = snapshot_size
+        self.buffer = bytearray(capacity * snapshot_size)
+        self.head = 0  # 下一条写入的位置
+        self.count = 0  # 有效快照数
+
+    def push(self, sim):
+        sim.write_snapshot(self.buffer, self.head * self.snapshot_size)
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def rewind(self, sim, ticks):
+        """恢复到最新快照之前 ticks 个 tick 的状态（不超过缓冲区长度），返回实际回退的 tick 数"""
+        if not self.count:
+            return 0
+        ticks = min(ticks, self.count - 1)
+        index = (self.head - 1 - ticks) % self.capacity
+        sim.read_snapshot(self.buffer, index * self.snapshot_size)
+        # 丢弃比它新的快照，之后从这里继续记录
+        self.head = (index + 1) % self.capacity
+        self.count -= ticks
+        return ticks
+
+
+def build_level(level_data=None, cancelled=None, max_attempts=20):
+    """构建一局（不加载图片）；level_data 为 None 时生成随机关卡，走不到终点的重新生成
+
+    cancelled 为 threading.Event，被设置时尽早放弃并返回 None。
+    """
+    sim = None
+    for _ in range(max_attempts):
+        if cancelled is not None and cancelled.is_set():
+            return None
+        sim = Simulation(level_data or MazeGenerator.generate_random_level(), load_images=False)
+        if level_data is not None or sim.is_solvable():
+            break
+    return sim
+
+
+class LevelPrefetcher:
+    """玩当前关卡时在后台线程生成并构建下一关，过关时直接换上"""
+
     def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+        self.future = None
+        self.level_num = None
+        self.cancelled = threading.Event()
+
+    def prefetch(self, level_num, level_data=None):
+        if self.future is not None and self.level_num == level_num:
+            return  # 已经在准备这一关
+        self.cancel()
+        self.level_num = level_num
+        self.cancelled = threading.Event()
+        self.future = self.executor.submit(build_level, level_data, self.cancelled)
+
+    def take(self, level_num):
+        """取出预构建的关卡，尚未完成时等待；没有预取这一关时返回 None"""
+        if self.future is None or self.level_num != level_num:
+            return None
+        future, self.future = self.future, None
+        return future.result()
+
+    def cancel(self):
+        if self.future is not None:
+            self.cancelled.set()
+            self.future.cancel()
+            self.future = None
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class Game:
+    def __init__(self, vsync=False, benchmark=False, telemetry=None, level_pack=None):
         self.music_list = ['./music/哈基米大冒险.mp3', './music/normal_no_more.mp3', './music/223AM.mp3',
                            './music/Color-X.mp3']
         self.name_list = ['哈基米大冒险', 'normal_no_more', '223AM', 'Color-X']
@@ -478,44 +1781,124 @@ class Game:
         self.volume_step = 0.1
         self.current_music_index = 0
         self.volume = 0.5
-        self.screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
+        # 只初始化显示和字体模块，音频在后台线程初始化
+        pygame.display.init()
+        pygame.font.init()
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        self.vsync = vsync
+        self.benchmark = benchmark  # 基准模式：渲染不限帧率并定期输出帧率统计
+        self.screen = self._create_window()
         pygame.display.set_caption("迷宫探险")
         self.clock = pygame.time.Clock()
 
-        # 加载字体
-        self.huge_font = load_chinese_font(100)
-        self.big_font = load_chinese_font(40)
-
-        self.font = load_chinese_font(36)
-        self.small_font = load_chinese_font(24)
-        self.tiny_font = load_chinese_font(18)
+        # 字体、图片和音乐在后台预加载，就绪前菜单只绘制不依赖它们的部分
+        self.assets = AssetLoader()
+        self.assets.submit('fonts', load_fonts)
+        self.assets.submit('menu_images', load_menu_images)
+        self.assets.submit('sprites', load_gameplay_sprites)
+        self.music = MusicManager(self.music_list, self.volume, telemetry=self.telemetry)
+        if self.music.valid_indices and self.current_music_index not in self.music.valid_indices:
+            self.current_music_index = self.music.valid_indices[0]
+        self.assets.submit('music', self.music.start, self.current_music_index)
+        self.huge_font = None
+        self.big_font = None
+        self.font = None
+        self.small_font = None
+        self.tiny_font = None
+        self.background_img = None
+        self.player_img = None
+        self.enemy_img = None
+        self.sprites_ready = False
+        self.first_frame_reported = False
 
         self.state = GameState.MENU
         self.player = None
         self.level = None
-        self.start_time = 0
         self.current_time = 0
         self.score = 0
         self.current_level_num = 1
         self.enemy = None
-
-        # 预定义关卡
-        self.levels = self._load_predefined_levels()
-        self.background_img = pygame.image.load(".\image\menu_background.jpg").convert()
-
-        self.player_img = pygame.image.load(".\image\player_right.png").convert_alpha()  # 玩家图片（带透明通道）
-        self.enemy_img = pygame.image.load(".\image\enemy_right.png").convert_alpha()  # 玩家图片（带透明通道）
-
-        self.player_img = pygame.transform.scale(self.player_img, (120, 120))  # 缩放图片
-        self.enemy_img = pygame.transform.scale(self.enemy_img, (120, 75))  # 缩放图片
+        self.sim = None
+        self.history = None  # 回退用的快照环形缓冲区
+        self.prefetcher = LevelPrefetcher()
+        self.move_input = (0, 0)
+
+        # 固定步长逻辑：accumulator 为尚未执行的游戏时间，alpha 为渲染插值比例
+        self.last_update = time.perf_counter()
+        self.accumulator = 0.0
+        self.alpha = 0.0
+        self.sim_ticks = 0
+        self.stats = self._new_stats()
+        self.stats_since = time.perf_counter()
+
+        # 关卡：有关卡包时按需从包中读取，否则使用预定义关卡；两者都支持 len() 和按下标取
+        self.levels = self._open_levels(level_pack)
+        self.selected_level = 1  # 选关界面当前选中的关卡编号
 
         # 初始化图片位置（根据图片尺寸调整初始坐标）
         self.animation_positions = {
-            "player": -self.player_img.get_width(),  # 玩家初始位置：完全在屏幕左侧外
-            "enemy": -self.enemy_img.get_width() * 3  # 敌人初始位置：更靠左，实现追逐延迟
+            "player": -MENU_PLAYER_SIZE[0],  # 玩家初始位置：完全在屏幕左侧外
+            "enemy": -MENU_ENEMY_SIZE[0] * 3  # 敌人初始位置：更靠左，实现追逐延迟
         }
 
-    def _load_predefined_levels(self):
+    @staticmethod
+    def _new_stats():
+        return {'frames': 0, 'ticks': 0, 'dropped_ticks': 0, 'max_frame_ms': 0}
+
+    def _create_window(self):
+        """开启垂直同步需要 SCALED 模式，驱动不支持时退回普通窗口"""
+        if self.vsync:
+            try:
+                return pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT), pygame.SCALED, vsync=1)
+            except pygame.error as e:
+                self.telemetry.warning('vsync_unavailable', error=str(e), msg=f"无法开启垂直同步: {e}")
+                self.vsync = False
+        return pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
+
+    def collect_assets(self, wait=False):
+        """取出后台已加载完成的资源；wait=True 时阻塞直到全部就绪"""
+        if self.huge_font is None and (wait or self.assets.ready('fonts')):
+            fonts = self.assets.get('fonts')
+            self.huge_font = fonts[100]
+            self.big_font = fonts[40]
+            self.font = fonts[36]
+            self.small_font = fonts[24]
+            self.tiny_font = fonts[18]
+
+        if self.background_img is None and (wait or self.assets.ready('menu_images')):
+            # convert 需要在主线程、显示模式设置之后调用
+            background, player_img, enemy_img = self.assets.get('menu_images')
+            self.background_img = background.convert()
+            self.player_img = player_img.convert_alpha()
+            self.enemy_img = enemy_img.convert_alpha()
+
+        if not self.sprites_ready and (wait or self.assets.ready('sprites')):
+            # 缩放和饱和度处理已在后台完成，主线程只做 convert_alpha
+            _preloaded_sprites.update(self.assets.get('sprites'))
+            for spec in GAMEPLAY_SPRITES:
+                load_sprite(*spec)
+            self.sprites_ready = True
+
+        if wait:
+            self.assets.wait_all()
+
+    def _open_levels(self, path=None):
+        path = path or (LEVEL_PACK_PATH if os.path.exists(LEVEL_PACK_PATH) else None)
+        if path:
+            try:
+                pack = LevelPack(path)
+            except (OSError, ValueError) as e:
+                self.telemetry.warning('level_pack_failed', path=path, error=str(e), msg=f"无法打开关卡包: {e}")
+            else:
+                if len(pack):
+                    return pack
+                pack.close()
+                self.telemetry.warning('level_pack_failed', path=path, error='empty pack',
+                                       msg=f"关卡包 {path} 中没有关卡，使用内置关卡")
+        return self._load_predefined_levels()
+
+    @staticmethod
+    def _load_predefined_levels():
         """加载预定义关卡"""
         levels = []
         # 关卡1：简单教学关卡
@@ -556,20 +1939,100 @@ class Game:
 
     def start_level(self, level_num):
         """开始指定关卡"""
-        print(f"开始关卡 {level_num}")
-        if level_num <= len(self.levels):
-            level_data = self.levels[level_num - 1]
-        else:
-            # 生成随机关卡
-            level_data = MazeGenerator.generate_random_level()
-
-        self.level = Level(level_data)
-        self.player = Player(*self.level.start_pos)
-        self.start_time = pygame.time.get_ticks()
-        global start_time
-        start_time = self.start_time
-        self.state = GameState.PLAYING
+        self.collect_assets(wait=True)  # 游戏界面需要全部字体
+        # 下一关通常已在后台构建好，直接换上；否则当场构建（超出预定义关卡时生成随机关卡）
+        sim = self.prefetcher.take(level_num)
+        prefetched = sim is not None
+        sim = sim or build_level(self.level_data(level_num))
+        sim.attach_images()
+        self.telemetry.info('level_start', level=level_num, random=level_num > len(self.levels),
+                            prefetched=prefetched, enemies=len(sim.level.enemies), msg=f"开始关卡 {level_num}")
+
+        self.sim = sim
+        self.level = self.sim.level
+        self.player = self.sim.player
+        self.history = SnapshotRing(REWIND_HISTORY_TICKS, self.sim.snapshot_size())
+        self.history.push(self.sim)
         self.current_level_num = level_num  # 更新关卡编号，用于处理进入下一关的逻辑
+        self.resume()
+        self.prefetcher.prefetch(level_num + 1, self.level_data(level_num + 1))
+
+    def level_data(self, level_num):
+        """预定义关卡的数据；超出预定义关卡时返回 None，表示随机生成"""
+        return self.levels[level_num - 1] if level_num <= len(self.levels) else None
+
+    def resume(self):
+        """从 self.sim 的当前状态继续游戏（开局、回退、读档后调用）"""
+        self.move_input = (0, 0)
+        self.sim_ticks = round(self.sim.current_time / FRAME_MS)
+        self.current_time = self.sim.current_time
+        self.accumulator = 0.0
+        self.alpha = 0.0
+        self.last_update = time.perf_counter()  # 加载关卡的耗时不计入游戏时间
+        self.state = GameState.PLAYING
+        if self.telemetry.debug_on and self.level.nav_grid.stats is None:
+            self.level.nav_grid.stats = {'searches': 0, 'failed': 0, 'ms': 0.0}
+
+    def rewind(self):
+        """回退 REWIND_TICKS 个 tick，游戏结束后也可以回退继续玩"""
+        ticks = self.history.rewind(self.sim, REWIND_TICKS)
+        self.telemetry.info('rewind', level=self.current_level_num, ticks=ticks,
+                            msg=f"回退 {ticks * FRAME_MS / 1000:.1f} 秒")
+        self.resume()
+
+    def quick_save(self):
+        level_json = json.dumps(self.sim.level_data, ensure_ascii=False).encode('utf-8')
+        snapshot = self.sim.snapshot()
+        # 先写临时文件再改名，写到一半出错时旧存档保持不变
+        temp_path = f"{QUICKSAVE_PATH}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(QUICKSAVE_HEADER.pack(QUICKSAVE_MAGIC, self.current_level_num, len(level_json), len(snapshot)))
+                f.write(level_json)
+                f.write(snapshot)
+            os.replace(temp_path, QUICKSAVE_PATH)
+        except OSError as e:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            self.telemetry.warning('quick_save_failed', error=str(e), msg=f"无法快速存档: {e}")
+            return
+        self.telemetry.info('quick_save', level=self.current_level_num, time_ms=self.sim.current_time,
+                            bytes=len(snapshot), msg=f"已快速存档: {QUICKSAVE_PATH}")
+
+    def quick_load(self):
+        """读取快速存档；存档属于当前关卡时直接恢复状态，否则先按存档中的关卡数据重建"""
+        try:
+            with open(QUICKSAVE_PATH, 'rb') as f:
+                data = f.read()
+            magic, level_num, json_len, snapshot_len = QUICKSAVE_HEADER.unpack_from(data)
+            if magic != QUICKSAVE_MAGIC:
+                raise ValueError("文件格式不正确")
+        except (OSError, ValueError, struct.error) as e:
+            self.telemetry.warning('quick_load_failed', error=str(e), msg=f"无法读取快速存档: {e}")
+            return
+        offset = QUICKSAVE_HEADER.size
+        level_json = data[offset:offset + json_len]
+        snapshot = data[offset + json_len:offset + json_len + snapshot_len]
+
+        current = self.sim and json.dumps(self.sim.level_data, ensure_ascii=False).encode('utf-8')
+        sim = self.sim
+        if current != level_json:
+            self.collect_assets(wait=True)
+            sim = Simulation(json.loads(level_json))
+        if len(snapshot) != sim.snapshot_size():
+            self.telemetry.warning('quick_load_failed', error='snapshot size mismatch',
+                                   msg="无法读取快速存档: 存档来自不兼容的版本")
+            return
+        self.sim = sim
+        self.level = self.sim.level
+        self.player = self.sim.player
+        self.sim.read_snapshot(snapshot)
+        self.history = SnapshotRing(REWIND_HISTORY_TICKS, self.sim.snapshot_size())
+        self.history.push(self.sim)
+        self.current_level_num = level_num
+        self.telemetry.info('quick_load', level=level_num, time_ms=self.sim.current_time, msg="已快速读档")
+        self.resume()
+        self.prefetcher.prefetch(level_num + 1, self.level_data(level_num + 1))
 
     def handle_input(self):
         keys = pygame.key.get_pressed()
@@ -584,43 +2047,50 @@ class Game:
             if keys[pygame.K_d] or keys[pygame.K_RIGHT]:
                 dx = 1
 
-            if dx != 0 or dy != 0:
-                self.player.move(dx, dy, self.level.obstacles)
+            self.move_input = (dx, dy)  # 由 tick 交给 Simulation 处理
 
     def update(self):
-        if self.state == GameState.PLAYING:
-            self.current_time = pygame.time.get_ticks() - self.start_time
-            self.player.invincible = self.current_time <= 2000  # 3秒无敌时间
-            self.player.invincible_time = self.current_time  # 记录无敌时间用于闪烁效果
-            # 更新障碍物（主要是敌人）
-            for obstacle in self.level.obstacles:
-                # 传递当前关卡的所有障碍物
-                obstacle.update(player=self.player, obstacles=self.level.obstacles)
-
-            if self.current_time <= 2000:
-                return
-
-            # 检查玩家与障碍物的碰撞
-            if not self.player.invincible and self.player.check_obstacles(self.level.obstacles):
-                print("碰到敌人，游戏结束")
-                self.state = GameState.GAME_OVER
-
-            # 检查生命值
-            if self.player.health <= 0:
-                print("生命值为0，游戏结束")
-                self.state = GameState.GAME_OVER
-
-            # 检查是否到达终点
-            player_rect = self.player.rect
-            end_rect = pygame.Rect(*self.level.end_pos, 40, 40)
-
-            if player_rect.colliderect(end_rect):
-                # 计算得分
-                time_bonus = max(0, 30000 - self.current_time) // 100
-                health_bonus = int(self.player.health * 10)
-                self.score = time_bonus + health_bonus
-                print(f"玩家到达终点！设置状态为VICTORY，得分: {self.score}")
-                self.state = GameState.VICTORY
+        """累积真实经过的时间，每满 FRAME_MS 执行一次 tick，逻辑速度与渲染帧率无关"""
+        now = time.perf_counter()
+        self.accumulator += (now - self.last_update) * 1000
+        self.last_update = now
+        if self.state != GameState.PLAYING:
+            self.accumulator = 0.0
+            return
+
+        ticks = 0
+        while self.accumulator >= FRAME_MS and self.state == GameState.PLAYING:
+            if ticks == MAX_TICKS_PER_FRAME:
+                # 逻辑跟不上时丢弃积压的时间：游戏暂时变慢，而不是每帧补更多 tick 越来越卡
+                self.stats['dropped_ticks'] += int(self.accumulator // FRAME_MS)
+                self.accumulator %= FRAME_MS
+                break
+            self.accumulator -= FRAME_MS
+            self.tick()
+            ticks += 1
+        self.stats['ticks'] += ticks
+        self.alpha = self.accumulator / FRAME_MS
+
+    def tick(self):
+        """执行一个固定步长的逻辑更新"""
+        self.sim_ticks += 1
+        result = self.sim.step(*self.move_input, int(self.sim_ticks * FRAME_MS))
+        self.current_time = self.sim.current_time
+        self.history.push(self.sim)
+
+        if result is None:
+            return
+        fields = {'level': self.current_level_num, 'time_ms': self.current_time, 'health': self.player.health}
+        if result == Simulation.DIED_ENEMY:
+            self.telemetry.info('death', cause=result, msg="碰到敌人，游戏结束", **fields)
+            self.state = GameState.GAME_OVER
+        elif result == Simulation.DIED_HEALTH:
+            self.telemetry.info('death', cause=result, msg="生命值为0，游戏结束", **fields)
+            self.state = GameState.GAME_OVER
+        elif result == Simulation.VICTORY:
+            self.score = self.sim.score
+            self.telemetry.info('victory', score=self.score, msg=f"玩家到达终点！得分: {self.score}", **fields)
+            self.state = GameState.VICTORY
 
     def draw_ui(self):
         """绘制游戏界面"""
@@ -674,7 +2144,8 @@ class Game:
         self.screen.blit(controls_text, (GAME_WIDTH + 10, y_offset))
         y_offset += 25
 
-        control_instructions = ["WASD移动", "ESC返回菜单", "+ 增大音量", "- 减小音量", "Tab 更换音乐", "0 静音"]
+        control_instructions = ["WASD移动", "ESC返回菜单", "Backspace 回退", "F5 快速存档", "F9 快速读档",
+                                "+ 增大音量", "- 减小音量", "Tab 更换音乐", "0 静音"]
         for instruction in control_instructions:
             text = self.tiny_font.render(instruction, True, WHITE)
             self.screen.blit(text, (GAME_WIDTH + 10, y_offset))
@@ -693,31 +2164,36 @@ class Game:
 
     def draw_menu(self):
         """绘制增强版主菜单，包含背景图片和动画元素"""
-        # 加载背景图片（假设已在__init__中加载）
-        background = pygame.transform.scale(self.background_img, (WINDOW_WIDTH, WINDOW_HEIGHT))
-        self.screen.blit(background, (0, 0))
+        # 背景图片在后台加载并预先缩放，就绪前使用纯色背景
+        if self.background_img is not None:
+            self.screen.blit(self.background_img, (0, 0))
+        else:
+            self.screen.fill((40, 40, 60))
 
         # 绘制半透明遮罩，降低背景对比度
         overlay = pygame.Surface((WINDOW_WIDTH, WINDOW_HEIGHT), pygame.SRCALPHA)
         overlay.fill((0, 0, 0, 100))
         self.screen.blit(overlay, (0, 0))
 
-        # 绘制标题文字和阴影
-        title_text = "澎菲躲耄耄"
-        title_shadow = self.huge_font.render(title_text, True, (30, 30, 30))
-        title = self.huge_font.render(title_text, True, (255, 255, 255))
+        # 绘制标题文字和阴影（字体就绪后）
+        if self.huge_font is not None:
+            title_text = "澎菲躲耄耄"
+            title_shadow = self.huge_font.render(title_text, True, (30, 30, 30))
+            title = self.huge_font.render(title_text, True, (255, 255, 255))
 
-        # 多层阴影实现发光效果
-        for offset in [(-3, -3), (3, -3), (-3, 3), (3, 3)]:
-            self.screen.blit(title_shadow, (WINDOW_WIDTH // 2 - title.get_width() // 2 + offset[0], 135 + offset[1]))
+            # 多层阴影实现发光效果
+            for offset in [(-3, -3), (3, -3), (-3, 3), (3, 3)]:
+                self.screen.blit(title_shadow,
+                                 (WINDOW_WIDTH // 2 - title.get_width() // 2 + offset[0], 135 + offset[1]))
 
-        self.screen.blit(title, (WINDOW_WIDTH // 2 - title.get_width() // 2, 135))
+            self.screen.blit(title, (WINDOW_WIDTH // 2 - title.get_width() // 2, 135))
 
         # 菜单选项数据
         menu_options = [
             {"key": "1", "text": "开始关卡1", "action": "start_level_1"},
             {"key": "2", "text": "开始关卡2", "action": "start_level_2"},
             {"key": "R", "text": "开始随机关卡", "action": "start_random"},
+            {"key": "L", "text": "选择关卡", "action": "level_select"},
             {"key": "Q", "text": "退出游戏", "action": "quit_game"}
         ]
 
@@ -760,6 +2236,9 @@ class Game:
             pygame.draw.circle(self.screen, (255, 255, 255, 80),
                                (key_bg_rect.centerx - 5, key_bg_rect.centery - 5), 6)
 
+            if self.big_font is None:
+                continue
+
             key_text = self.big_font.render(option["key"], True, (255, 255, 255))
             key_text_rect = key_text.get_rect(center=key_bg_rect.center)
             self.screen.blit(key_text, key_text_rect)
@@ -780,25 +2259,58 @@ class Game:
         self.animation_positions["player"] += animation_speed
         self.animation_positions["enemy"] += animation_speed  # 敌人速度比玩家快，实现追逐效果
 
-        # 玩家图片绘制
+        # 玩家图片绘制（图片就绪前只推进位置）
         player_x = self.animation_positions["player"]
-        if player_x < WINDOW_WIDTH:
+        if player_x < WINDOW_WIDTH and self.player_img is not None:
             # 绘制玩家图片
             self.screen.blit(self.player_img, (player_x, animation_y - 40))
 
         # 重置位置：当图片完全离开屏幕右侧时，回到左侧外
-        if player_x > WINDOW_WIDTH + self.player_img.get_width():
-            self.animation_positions["player"] = -self.player_img.get_width()
+        if player_x > WINDOW_WIDTH + MENU_PLAYER_SIZE[0]:
+            self.animation_positions["player"] = -MENU_PLAYER_SIZE[0]
 
         # 敌人图片绘制
         enemy_x = self.animation_positions["enemy"]
-        if enemy_x < WINDOW_WIDTH:
+        if enemy_x < WINDOW_WIDTH and self.enemy_img is not None:
             # 绘制敌人图片（不翻转，默认面向右侧）
             self.screen.blit(self.enemy_img, (enemy_x, animation_y))
 
         # 重置位置：当图片完全离开屏幕右侧时，回到更左侧的位置（保持追逐逻辑）
-        if enemy_x > WINDOW_WIDTH + self.enemy_img.get_width():
-            self.animation_positions["enemy"] = -self.enemy_img.get_width()
+        if enemy_x > WINDOW_WIDTH + MENU_ENEMY_SIZE[0]:
+            self.animation_positions["enemy"] = -MENU_ENEMY_SIZE[0]
+
+    def draw_level_select(self):
+        """选关界面：显示选中关卡的编号、障碍物统计和缩略图"""
+        self.screen.fill((40, 40, 60))
+        if self.big_font is None:
+            return
+        total = len(self.levels)
+        level_data = self.levels[self.selected_level - 1]
+        obstacles = level_data.get('obstacles', [])
+        enemies = sum(obs['type'] == ObstacleType.ENEMY.value for obs in obstacles)
+
+        title = self.big_font.render(f"选择关卡: {self.selected_level} / {total}", True, WHITE)
+        self.screen.blit(title, title.get_rect(center=(WINDOW_WIDTH // 2, 60)))
+        info = self.small_font.render(f"障碍物: {len(obstacles) - enemies}  敌人: {enemies}", True, WHITE)
+        self.screen.blit(info, info.get_rect(center=(WINDOW_WIDTH // 2, 110)))
+
+        # 缩略图：按一半比例绘制关卡布局
+        scale = 0.5
+        preview = pygame.Rect(0, 0, int(GAME_WIDTH * scale), int(GAME_HEIGHT * scale))
+        preview.center = (WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2 + 20)
+        pygame.draw.rect(self.screen, WHITE, preview)
+        for obs in obstacles:
+            rect = (preview.x + obs['x'] * scale, preview.y + obs['y'] * scale,
+                    max(1, obs['width'] * scale), max(1, obs['height'] * scale))
+            pygame.draw.rect(self.screen, Obstacle.COLOR_MAP[ObstacleType(obs['type'])], rect)
+        for pos, color, size in ((level_data.get('start', (50, 50)), GREEN, 30),
+                                 (level_data.get('end', (GAME_WIDTH - 100, GAME_HEIGHT - 100)), YELLOW, 40)):
+            pygame.draw.rect(self.screen, color,
+                             (preview.x + pos[0] * scale, preview.y + pos[1] * scale, size * scale, size * scale))
+        pygame.draw.rect(self.screen, BLACK, preview, 2)
+
+        hint = self.tiny_font.render("左/右 切换  上/下 跳10关  PgUp/PgDn 跳100关  Enter 开始  ESC 返回", True, WHITE)
+        self.screen.blit(hint, hint.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT - 60)))
 
     def draw_game_over(self):
         """绘制游戏结束画面"""
@@ -816,7 +2328,7 @@ class Game:
         # state_rect = state_text.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2 - 40))
         # self.screen.blit(state_text, state_rect)
 
-        restart_text = self.big_font.render("按 R 重新开始", True, WHITE)
+        restart_text = self.big_font.render("按 R 重新开始，Backspace 回退", True, WHITE)
         restart_rect = restart_text.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2))
         self.screen.blit(restart_text, restart_rect)
 
@@ -861,6 +2373,9 @@ class Game:
         running = True
 
         while running:
+            self.collect_assets()
+            self.music.update()
+
             # 清空屏幕
             self.screen.fill(BLACK)
 
@@ -869,76 +2384,104 @@ class Game:
                     running = False
 
                 elif event.type == pygame.KEYDOWN:  # 用户按键
-                    key_name = pygame.key.name(event.key)
-                    print(f"检测到按键: {key_name}, 当前状态: {self.state}")
+                    if self.telemetry.debug_on:
+                        self.telemetry.debug('key', key=pygame.key.name(event.key), state=self.state.name)
 
                     if self.state == GameState.MENU:
                         if event.key == pygame.K_1:
-                            print("开始关卡1")
                             self.start_level(1)
                         elif event.key == pygame.K_2:
-                            print("开始关卡2")
                             self.start_level(2)
                         elif event.key == pygame.K_r:
-                            print("开始随机关卡")
-                            self.start_level(999)  # 随机关卡
+                            self.start_level(len(self.levels) + 1)  # 编号超出已有关卡即为随机关卡
+                        elif event.key == pygame.K_l:
+                            self.collect_assets(wait=True)  # 选关界面需要全部字体
+                            self.state = GameState.LEVEL_SELECT
                         elif event.key == pygame.K_q:
-                            print("退出游戏")
+                            self.telemetry.info('quit', msg="退出游戏")
                             running = False
+                        elif event.key == pygame.K_F9:
+                            self.quick_load()
+
+                    elif self.state == GameState.LEVEL_SELECT:
+                        steps = {pygame.K_LEFT: -1, pygame.K_RIGHT: 1, pygame.K_UP: -10, pygame.K_DOWN: 10,
+                                 pygame.K_PAGEUP: -100, pygame.K_PAGEDOWN: 100}
+                        if event.key in steps:
+                            self.selected_level = max(1, min(len(self.levels), self.selected_level + steps[event.key]))
+                        elif event.key == pygame.K_HOME:
+                            self.selected_level = 1
+                        elif event.key == pygame.K_END:
+                            self.selected_level = len(self.levels)
+                        elif event.key in (pygame.K_RETURN, pygame.K_KP_ENTER):
+                            self.start_level(self.selected_level)
+                        elif event.key == pygame.K_ESCAPE:
+                            self.state = GameState.MENU
 
                     elif self.state == GameState.PLAYING:
                         if event.key == pygame.K_ESCAPE:
-                            print("返回主菜单")
+                            self.telemetry.info('menu', level=self.current_level_num, msg="返回主菜单")
                             self.state = GameState.MENU
+                            self.prefetcher.cancel()  # 回到菜单后不再需要预构建的下一关
+
+                        elif event.key == pygame.K_BACKSPACE:  # 回退
+                            self.rewind()
+
+                        elif event.key == pygame.K_F5:
+                            self.quick_save()
+
+                        elif event.key == pygame.K_F9:
+                            self.quick_load()
 
                         elif event.key == pygame.K_TAB:  # 切换音乐
-                            self.current_music_index = (self.current_music_index + 1) % len(self.music_list)
-                            self.load_music(self.current_music_index)  # 加载并播放新音乐
-                            print(f"切换到音乐: {self.music_list[self.current_music_index]}")
+                            next_index = self.music.next_index()
+                            if next_index not in (None, self.current_music_index) and self.load_music(next_index):
+                                # 后台加载，淡出后播放
+                                self.current_music_index = next_index
+                                self.telemetry.info('music', track=self.name_list[next_index],
+                                                    msg=f"切换到音乐: {self.music_list[next_index]}")
 
                         elif event.key == pygame.K_PLUS or event.key == pygame.K_KP_PLUS:  # 增大音量 (+ 键)
                             self.volume = min(1.0, self.volume + self.volume_step)
-                            pygame.mixer.music.set_volume(self.volume)
-                            print(f"音量增大到: {self.volume:.1f}")
+                            self.music.set_volume(self.volume)
+                            self.telemetry.info('volume', volume=self.volume, msg=f"音量增大到: {self.volume:.1f}")
 
                         elif event.key == pygame.K_MINUS or event.key == pygame.K_KP_MINUS:  # 减小音量 (- 键)
                             self.volume = max(0.0, self.volume - self.volume_step)
-                            pygame.mixer.music.set_volume(self.volume)
-                            print(f"音量减小到: {self.volume:.1f}")
+                            self.music.set_volume(self.volume)
+                            self.telemetry.info('volume', volume=self.volume, msg=f"音量减小到: {self.volume:.1f}")
 
                         elif event.key == pygame.K_0:  # 静音/取消静音
                             if self.volume > 0:
                                 self.last_volume = self.volume  # 保存当前音量
                                 self.volume = 0
-                                pygame.mixer.music.set_volume(0)
-                                print("已静音")
+                                self.music.set_volume(0)
+                                self.telemetry.info('volume', volume=0, msg="已静音")
                             else:
                                 self.volume = self.last_volume if hasattr(self, 'last_volume') else 0.5
-                                pygame.mixer.music.set_volume(self.volume)
-                                print(f"已恢复音量: {self.volume:.1f}")
+                                self.music.set_volume(self.volume)
+                                self.telemetry.info('volume', volume=self.volume, msg=f"已恢复音量: {self.volume:.1f}")
 
 
 
                     elif self.state == GameState.GAME_OVER:
-                        print(f"游戏结束状态，按键: {key_name}")
                         if event.key == pygame.K_r:
-                            print("重新开始关卡")
                             self.start_level(self.current_level_num)
-                        elif event.key == pygame.K_m:
-                            print("返回主菜单")
-                            self.state = GameState.MENU
-                        elif event.key == pygame.K_ESCAPE:
-                            print("ESC返回主菜单")
+                        elif event.key == pygame.K_BACKSPACE:
+                            self.rewind()
+                        elif event.key == pygame.K_F9:
+                            self.quick_load()
+                        elif event.key == pygame.K_m or event.key == pygame.K_ESCAPE:
+                            self.telemetry.info('menu', level=self.current_level_num, msg="返回主菜单")
                             self.state = GameState.MENU
+                            self.prefetcher.cancel()
 
                     elif self.state == GameState.VICTORY:
-                        print(f"胜利状态，按键: {key_name}")
                         if event.key == pygame.K_n or event.key == pygame.K_SPACE:
-                            print("进入下一关")
                             self.start_level(self.current_level_num + 1)
                         elif event.key == pygame.K_m or event.key == pygame.K_ESCAPE:
-                            print("返回主菜单")
+                            self.telemetry.info('menu', level=self.current_level_num, msg="返回主菜单")
                             self.state = GameState.MENU
+                            self.prefetcher.cancel()
 
             # 处理输入
             self.handle_input()
@@ -949,11 +2492,16 @@ class Game:
             # 绘制
             if self.state == GameState.MENU:
                 self.draw_menu()
+            elif self.state == GameState.LEVEL_SELECT:
+                self.draw_level_select()
             elif self.state in [GameState.PLAYING, GameState.GAME_OVER, GameState.VICTORY]:
                 # 绘制游戏区域背景
                 game_area = pygame.Rect(0, 0, GAME_WIDTH, GAME_HEIGHT)
                 pygame.draw.rect(self.screen, WHITE, game_area)
 
+                # 玩家和敌人画在两个 tick 之间的插值位置，画完恢复
+                restore = self.sim.interpolate(self.alpha) if self.state == GameState.PLAYING else None
+
                 # 绘制关卡
                 if self.level:
                     self.level.draw(self.screen)
@@ -962,6 +2510,9 @@ class Game:
                 if self.player:
                     self.player.draw(self.screen)
 
+                if restore:
+                    self.sim.restore_positions(restore)
+
                 # 绘制游戏区域边界
                 pygame.draw.rect(self.screen, BLACK, game_area, 2)
 
@@ -975,12 +2526,61 @@ class Game:
                     self.draw_victory()
 
             pygame.display.flip()
-            self.clock.tick(60)
-
+            if not self.first_frame_reported:
+                self.report_startup()
+            # 垂直同步时 flip 本身会等待刷新；基准模式完全不限帧率
+            self.clock.tick() if self.vsync or self.benchmark else self.clock.tick(MAX_RENDER_FPS)
+            self.stats['frames'] += 1
+            self.stats['max_frame_ms'] = max(self.stats['max_frame_ms'], self.clock.get_time())
+            if self.benchmark or self.telemetry.debug_on:
+                self.report_stats()
+
+        self.assets.shutdown()
+        self.music.shutdown()
+        self.prefetcher.shutdown()
+        self.telemetry.close()
+        if isinstance(self.levels, LevelPack):
+            self.levels.close()
         pygame.quit()
 
+    def report_startup(self):
+        """输出启动耗时：首帧时间和后台资源全部就绪的时间"""
+        self.first_frame_reported = True
+        first_frame_ms = (time.perf_counter() - PROCESS_START) * 1000
+        status = "达标" if first_frame_ms <= STARTUP_TARGET_MS else f"超过目标 {STARTUP_TARGET_MS} ms"
+        self.telemetry.info('startup', first_frame_ms=round(first_frame_ms),
+                            msg=f"首帧耗时: {first_frame_ms:.0f} ms（{status}）")
+
+        def assets_ready():
+            ready_ms = (time.perf_counter() - PROCESS_START) * 1000
+            self.telemetry.info('assets_ready', ready_ms=round(ready_ms), msg=f"资源预加载完成: {ready_ms:.0f} ms")
+        self.assets.when_all_done(assets_ready)
+
+    def report_stats(self):
+        """定期汇总渲染帧率、逻辑 tick 速率、丢弃的 tick 数和寻路统计"""
+        elapsed = (time.perf_counter() - self.stats_since) * 1000
+        if elapsed < STATS_REPORT_MS:
+            return
+        stats = self.stats
+        fps = stats['frames'] * 1000 / elapsed
+        tps = stats['ticks'] * 1000 / elapsed
+        if self.benchmark:
+            # 经遥测写线程输出，游戏循环里不直接 print
+            self.telemetry.info('benchmark', fps=round(fps, 1), tps=round(tps, 1),
+                                dropped_ticks=stats['dropped_ticks'],
+                                msg=f"渲染: {fps:.0f} FPS, 逻辑: {tps:.0f} tick/s, 丢弃: {stats['dropped_ticks']} tick")
+        if self.telemetry.debug_on:
+            path_stats = self.level.nav_grid.stats if self.level and self.state == GameState.PLAYING else None
+            self.telemetry.debug('frame_stats', state=self.state.name, fps=round(fps, 1), tps=round(tps, 1),
+                                 max_frame_ms=stats['max_frame_ms'], dropped_ticks=stats['dropped_ticks'],
+                                 paths=dict(path_stats) if path_stats else None)
+            if path_stats:
+                path_stats.update(searches=0, failed=0, ms=0.0)
+        self.stats = self._new_stats()
+        self.stats_since = time.perf_counter()
+
     def load_music(self, current_music_index):
-        play_background_music(self.music_list[current_music_index])
+        return self.music.switch(current_music_index)
 
 
 # 示例JSON关卡文件格式
@@ -1063,9 +2663,26 @@ def enhance_color_saturation(image, factor=1.5):
 
 
 if __name__ == "__main__":
-    # 保存示例关卡文件
-    save_example_level()
-    play_background_music('music/哈基米大冒险.mp3', -1, 0.5)
-    # 启动游戏
-    game = Game()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="迷宫探险")
+    parser.add_argument('--vsync', action='store_true', help="开启垂直同步")
+    parser.add_argument('--benchmark', action='store_true', help="渲染不限帧率，并每秒输出帧率统计")
+    parser.add_argument('--log-level', default='info', choices=[level.name.lower() for level in LogLevel],
+                        help="遥测事件级别，debug 会记录按键、帧时间和寻路统计")
+    parser.add_argument('--log-dir', default=TELEMETRY_DIR, help="遥测 JSONL 文件目录")
+    parser.add_argument('--bake', action='store_true', help="预先处理全部图片写入缓存目录后退出")
+    parser.add_argument('--pack', help=f"关卡包文件，默认在存在时使用 {LEVEL_PACK_PATH}")
+    args = parser.parse_args()
+
+    if args.bake:
+        print(f"已烘焙 {bake_sprites()} 张图片到 {SPRITE_CACHE_DIR}")
+        raise SystemExit
+
+    # 示例关卡文件不存在时才生成，避免每次启动都重写
+    if not os.path.exists('example_level.json'):
+        save_example_level()
+    # 启动游戏（背景音乐由 Game 在后台线程加载播放）
+    telemetry = Telemetry(LogLevel[args.log_level.upper()], args.log_dir)
+    game = Game(vsync=args.vsync, benchmark=args.benchmark, telemetry=telemetry, level_pack=args.pack)
     game.run()
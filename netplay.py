@@ -0,0 +1,523 @@
+"""局域网联机：一台机器作为权威服务器运行游戏逻辑，其他机器连接后发送输入、渲染服务器下发的状态
+
+服务器按固定步长推进 Simulation，每个 tick 只把相对于该客户端上一次快照发生变化的实体发出去
+（增量编码，坐标变化小时用 1 字节差值，血量量化为 0.5 的整数倍）。第一个连上的客户端控制玩家，
+其余客户端只观战；控制者断开后由下一个客户端接管。
+
+用法：
+    python netplay.py server --level 1 --port 8765
+    python netplay.py client --host 127.0.0.1 --port 8765
+    python netplay.py loopback --clients 3 --seconds 5     # 本机回环测试，输出带宽和延迟统计
+"""
+import argparse
+import asyncio
+import json
+import random
+import struct
+import time
+from collections import deque
+
+from main import FRAME_MS, MAX_TICKS_PER_FRAME, Game, MazeGenerator, Simulation
+
+DEFAULT_PORT = 8765
+RESTART_DELAY_S = 3  # 一局结束后多久重新开始
+MAX_WRITE_BUFFER = 64 * 1024  # 客户端积压超过该字节数时跳过快照，等它追上后继续发送增量
+MAX_FRAME_BYTES = 64 * 1024 * 1024  # 单条消息的上限，超过时视为连接出错
+
+# 所有消息都是 4 字节长度前缀 + 消息体，消息体第一个字节为类型（欢迎消息带着整个关卡，可能很大）
+FRAME = struct.Struct('<I')
+MSG_WELCOME = b'W'  # 服务器 -> 客户端：客户端编号、是否控制玩家，后接关卡JSON
+MSG_INPUT = b'I'  # 客户端 -> 服务器：输入序号、移动方向
+MSG_SNAPSHOT = b'S'  # 服务器 -> 客户端：状态增量
+WELCOME = struct.Struct('<cBB')
+INPUT = struct.Struct('<cIbb')
+# 快照头：tick、服务器已处理的最新输入序号、关卡内时间、结果、得分、变化的实体数
+SNAPSHOT = struct.Struct('<cIIIBHH')
+ENTITY = struct.Struct('<HB')  # 实体编号（0 为玩家，之后为敌人）、字段掩码
+
+# 实体字段掩码
+F_X = 0x01
+F_Y = 0x02
+F_HEALTH = 0x04
+F_FACING = 0x08  # 朝向发生变化，朝向本身由 F_LEFT 表示
+F_SMALL = 0x10  # 坐标以 1 字节差值发送
+F_LEFT = 0x20
+
+RESULTS = Simulation.RESULT_CODES
+
+
+def entity_states(sim, previous=None):
+    """把玩家和敌人量化为 (x, y, 血量*2, 是否朝左) 列表；无界面模式下敌人朝向由移动方向推断"""
+    player = sim.player
+    states = [(player.rect.x, player.rect.y, max(0, min(255, int(player.health * 2))), player.direction < 0)]
+    for i, enemy in enumerate(sim.level.enemies, start=1):
+        x, y = enemy.rect.topleft
+        left = previous[i][3] if previous else False
+        if previous and x != previous[i][0]:
+            left = x < previous[i][0]
+        states.append((x, y, 0, left))
+    return states
+
+
+def encode_snapshot(tick, ack, sim, states, baseline):
+    """编码 states 相对 baseline（客户端已知状态，None 表示全量）的增量"""
+    parts = []
+    count = 0
+    for i, state in enumerate(states):
+        old = baseline[i] if baseline else None
+        if state == old:
+            continue
+        x, y, health, left = state
+        mask = F_LEFT if left else 0
+        fields = []
+        if old is None:
+            mask |= F_X | F_Y | F_HEALTH | F_FACING
+            fields = [struct.pack('<hhB', x, y, health)]
+        else:
+            dx, dy = x - old[0], y - old[1]
+            if dx or dy:
+                mask |= (F_X if dx else 0) | (F_Y if dy else 0)
+                small = -128 <= dx <= 127 and -128 <= dy <= 127
+                fmt = 'b' if small else 'h'
+                mask |= F_SMALL if small else 0
+                if dx:
+                    fields.append(struct.pack(fmt, dx if small else x))
+                if dy:
+                    fields.append(struct.pack(fmt, dy if small else y))
+            if health != old[2]:
+                mask |= F_HEALTH
+                fields.append(struct.pack('B', health))
+            if left != old[3]:
+                mask |= F_FACING
+        parts.append(ENTITY.pack(i, mask))
+        parts.extend(fields)
+        count += 1
+    header = SNAPSHOT.pack(MSG_SNAPSHOT, tick, ack, int(sim.current_time), RESULTS.index(sim.result),
+                           sim.score, count)
+    return header + b''.join(parts)
+
+
+def decode_snapshot(payload, entities):
+    """把快照增量应用到 entities（编号 -> [x, y, 血量*2, 是否朝左]），返回快照头字段"""
+    _, tick, ack, time_ms, result, score, count = SNAPSHOT.unpack_from(payload)
+    offset = SNAPSHOT.size
+    for _ in range(count):
+        i, mask = ENTITY.unpack_from(payload, offset)
+        offset += ENTITY.size
+        state = entities.setdefault(i, [0, 0, 0, False])
+        if mask & F_SMALL:
+            for bit, index in ((F_X, 0), (F_Y, 1)):
+                if mask & bit:
+                    state[index] += struct.unpack_from('b', payload, offset)[0]
+                    offset += 1
+        else:
+            for bit, index in ((F_X, 0), (F_Y, 1)):
+                if mask & bit:
+                    state[index] = struct.unpack_from('<h', payload, offset)[0]
+                    offset += 2
+        if mask & F_HEALTH:
+            state[2] = payload[offset]
+            offset += 1
+        if mask & F_FACING:
+            state[3] = bool(mask & F_LEFT)
+    return tick, ack, time_ms, RESULTS[result], score
+
+
+def frame(payload):
+    return FRAME.pack(len(payload)) + payload
+
+
+async def read_frame(reader):
+    size, = FRAME.unpack(await reader.readexactly(FRAME.size))
+    if size > MAX_FRAME_BYTES:
+        raise ConnectionError(f"消息过大: {size} 字节")
+    return await reader.readexactly(size)
+
+
+class _Connection:
+    def __init__(self, client_id, writer):
+        self.client_id = client_id
+        self.writer = writer
+        self.task = asyncio.current_task()
+        self.baseline = None  # 该客户端已收到的实体状态
+        self.input = (0, 0)
+        self.last_seq = 0
+        self.bytes_out = 0
+        self.snapshots = 0
+        self.skipped = 0
+
+    def send(self, payload):
+        data = frame(payload)
+        self.writer.write(data)
+        self.bytes_out += len(data)
+
+
+class NetServer:
+    """权威服务器：固定步长推进一局游戏，向每个客户端发送增量快照"""
+
+    def __init__(self, level_data, host='127.0.0.1', port=DEFAULT_PORT, snapshot_every=1):
+        self.level_data = level_data
+        self.level_json = json.dumps(level_data, ensure_ascii=False).encode('utf-8')
+        self.host = host
+        self.port = port
+        self.snapshot_every = snapshot_every  # 每几个 tick 发送一次快照
+        self.connections = {}
+        self.controller = None  # 控制玩家的客户端编号
+        self.next_id = 0
+        self.sim = None
+        self.tick = 0
+        self.states = None
+        self.server = None
+        self.loop_task = None
+        self.tick_ms = deque(maxlen=600)  # 最近的 tick 耗时，用于统计
+        self.dropped_ticks = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]  # port=0 时由系统分配
+        self._new_round()
+        self.loop_task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self.loop_task.cancel()
+        self.server.close()
+        handlers = [connection.task for connection in self.connections.values()]
+        for connection in list(self.connections.values()):
+            connection.writer.close()
+        await asyncio.gather(*handlers)  # 连接关闭后各处理协程读到 EOF 自行退出
+        await self.server.wait_closed()
+
+    def _new_round(self):
+        self.sim = Simulation(self.level_data, load_images=False)
+        self.tick = 0
+        self.states = entity_states(self.sim)
+        for connection in self.connections.values():
+            self._welcome(connection)
+
+    def _welcome(self, connection):
+        connection.baseline = None
+        connection.send(WELCOME.pack(MSG_WELCOME, connection.client_id, connection.client_id == self.controller)
+                        + self.level_json)
+
+    async def _handle(self, reader, writer):
+        connection = _Connection(self.next_id, writer)
+        self.next_id += 1
+        self.connections[connection.client_id] = connection
+        if self.controller is None:
+            self.controller = connection.client_id
+        try:
+            self._welcome(connection)
+            while True:
+                payload = await read_frame(reader)
+                if payload[:1] == MSG_INPUT:
+                    try:
+                        _, seq, dx, dy = INPUT.unpack(payload)
+                    except struct.error:
+                        continue  # 长度不对的输入直接丢弃
+                    connection.last_seq = seq
+                    connection.input = (max(-1, min(1, dx)), max(-1, min(1, dy)))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            del self.connections[connection.client_id]
+            writer.close()
+            if self.controller == connection.client_id:
+                # 控制权交给最早连上的观战者，并让它们知道自己的新身份
+                self.controller = min(self.connections, default=None)
+                if self.controller is not None:
+                    self._welcome(self.connections[self.controller])
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        interval = FRAME_MS / 1000
+        next_tick = loop.time()
+        finished_at = None
+        while True:
+            next_tick += interval
+            delay = next_tick - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif -delay > interval * MAX_TICKS_PER_FRAME:
+                # 落后太多时丢弃积压的 tick，而不是连续补帧
+                self.dropped_ticks += int(-delay / interval)
+                next_tick = loop.time()
+
+            if self.sim.result is not None:
+                finished_at = finished_at or loop.time()
+                if loop.time() - finished_at >= RESTART_DELAY_S:
+                    finished_at = None
+                    self._new_round()
+                continue
+            self.step()
+
+    def step(self):
+        """推进一个 tick 并向所有客户端发送快照"""
+        began = time.perf_counter()
+        controller = self.connections.get(self.controller)
+        dx, dy = controller.input if controller else (0, 0)
+        self.tick += 1
+        self.sim.step(dx, dy, int(self.tick * FRAME_MS))
+        self.states = entity_states(self.sim, self.states)
+        if self.tick % self.snapshot_every == 0 or self.sim.result is not None:
+            for connection in self.connections.values():
+                if connection.writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+                    connection.skipped += 1
+                    continue
+                ack = connection.last_seq
+                connection.send(encode_snapshot(self.tick, ack, self.sim, self.states, connection.baseline))
+                connection.baseline = self.states
+                connection.snapshots += 1
+        self.tick_ms.append((time.perf_counter() - began) * 1000)
+
+    def metrics(self):
+        return {
+            'tick': self.tick,
+            'clients': len(self.connections),
+            'avg_tick_ms': sum(self.tick_ms) / len(self.tick_ms) if self.tick_ms else 0,
+            'dropped_ticks': self.dropped_ticks,
+            'bytes_out': {c.client_id: c.bytes_out for c in self.connections.values()},
+            'skipped_snapshots': sum(c.skipped for c in self.connections.values()),
+        }
+
+
+class NetClient:
+    """连接服务器，维护服务器状态的镜像，记录带宽和输入延迟"""
+
+    def __init__(self):
+        self.reader = None
+        self.writer = None
+        self.client_id = None
+        self.controller = False
+        self.level_data = None
+        self.level_version = 0  # 每收到一次关卡数据加一，渲染端据此重建关卡
+        self.entities = {}
+        self.tick = 0
+        self.time_ms = 0
+        self.result = None
+        self.score = 0
+        self.seq = 0
+        self.sent = deque(maxlen=256)  # (输入序号, 发送时间)，用于计算延迟
+        self.acked = 0
+        self.rtt_ms = deque(maxlen=256)
+        self.bytes_in = 0
+        self.snapshot_bytes = 0
+        self.bytes_out = 0
+        self.snapshots = 0
+        self.started = None
+        self.task = None
+        self.welcomed = asyncio.Event()
+
+    async def connect(self, host='127.0.0.1', port=DEFAULT_PORT):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.started = time.perf_counter()
+        self.task = asyncio.create_task(self._receive())
+        welcomed = asyncio.create_task(self.welcomed.wait())
+        await asyncio.wait({welcomed, self.task}, return_when=asyncio.FIRST_COMPLETED)
+        if not self.welcomed.is_set():
+            welcomed.cancel()
+            raise ConnectionError("服务器在发送关卡数据前断开了连接")
+
+    async def close(self):
+        self.writer.close()
+        self.task.cancel()
+
+    async def _receive(self):
+        try:
+            while True:
+                payload = await read_frame(self.reader)
+                self.bytes_in += FRAME.size + len(payload)
+                kind = payload[:1]
+                if kind == MSG_WELCOME:
+                    _, self.client_id, controller = WELCOME.unpack_from(payload)
+                    self.controller = bool(controller)
+                    self.level_data = json.loads(payload[WELCOME.size:])
+                    self.level_version += 1
+                    self.entities = {}
+                    self.result = None
+                    self.welcomed.set()
+                elif kind == MSG_SNAPSHOT:
+                    self.tick, ack, self.time_ms, self.result, self.score = decode_snapshot(payload, self.entities)
+                    self.snapshots += 1
+                    self.snapshot_bytes += FRAME.size + len(payload)
+                    self._ack(ack)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    def _ack(self, ack):
+        """服务器处理到 ack 号输入时，记录从发送该输入到看到其结果的延迟"""
+        if ack <= self.acked:
+            return
+        self.acked = ack
+        now = time.perf_counter()
+        while self.sent and self.sent[0][0] <= ack:
+            seq, sent_at = self.sent.popleft()
+            if seq == ack:
+                self.rtt_ms.append((now - sent_at) * 1000)
+
+    def send_input(self, dx, dy):
+        self.seq += 1
+        self.sent.append((self.seq, time.perf_counter()))
+        data = frame(INPUT.pack(MSG_INPUT, self.seq, dx, dy))
+        self.writer.write(data)
+        self.bytes_out += len(data)
+
+    def metrics(self):
+        elapsed = max(1e-9, time.perf_counter() - self.started)
+        rtt = sorted(self.rtt_ms)
+        return {
+            'client': self.client_id,
+            'snapshots': self.snapshots,
+            'avg_snapshot_bytes': self.snapshot_bytes / self.snapshots if self.snapshots else 0,
+            'kbps_in': self.bytes_in * 8 / 1000 / elapsed,
+            'kbps_out': self.bytes_out * 8 / 1000 / elapsed,
+            'rtt_avg_ms': sum(rtt) / len(rtt) if rtt else None,
+            'rtt_p95_ms': rtt[int(len(rtt) * 0.95)] if rtt else None,
+        }
+
+    def apply_to(self, sim):
+        """把镜像状态写入本地 Simulation 的玩家和敌人，供渲染使用"""
+        bodies = [sim.player] + sim.level.enemies
+        for i, (x, y, health, left) in self.entities.items():
+            if i >= len(bodies):
+                continue
+            body = bodies[i]
+            body.rect.topleft = (x, y)
+            body.image = body.image_left if left else body.image_right
+            if i == 0:
+                body.health = health / 2
+        sim.current_time = self.time_ms
+        sim.player.invincible = self.time_ms <= Simulation.INVINCIBLE_MS
+        sim.player.invincible_time = self.time_ms
+
+
+async def run_window_client(host, port):
+    """带窗口的客户端：键盘输入发给服务器，用本地关卡对象绘制服务器状态"""
+    import pygame
+    from main import (BLACK, GAME_HEIGHT, GAME_WIDTH, GREEN, RED, WHITE, WINDOW_HEIGHT, WINDOW_WIDTH,
+                      load_chinese_font)
+
+    client = NetClient()
+    await client.connect(host, port)
+    pygame.display.init()
+    pygame.font.init()
+    screen = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT))
+    pygame.display.set_caption("迷宫探险 - 联机")
+    clock = pygame.time.Clock()
+    font = load_chinese_font(24)
+    big_font = load_chinese_font(100)
+    sim = None
+    version = 0
+    running = True
+    while running and not client.task.done():
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+                running = False
+        if version != client.level_version:
+            version = client.level_version
+            sim = Simulation(client.level_data)
+        if client.controller:
+            keys = pygame.key.get_pressed()
+            dx = (keys[pygame.K_d] or keys[pygame.K_RIGHT]) - (keys[pygame.K_a] or keys[pygame.K_LEFT])
+            dy = (keys[pygame.K_s] or keys[pygame.K_DOWN]) - (keys[pygame.K_w] or keys[pygame.K_UP])
+            client.send_input(dx, dy)
+
+        client.apply_to(sim)
+        screen.fill(BLACK)
+        pygame.draw.rect(screen, WHITE, (0, 0, GAME_WIDTH, GAME_HEIGHT))
+        sim.level.draw(screen)
+        sim.player.draw(screen)
+        metrics = client.metrics()
+        rtt = metrics['rtt_avg_ms']
+        lines = [
+            "控制玩家" if client.controller else "观战中",
+            f"时间: {client.time_ms // 1000}s",
+            f"血量: {int(sim.player.health)}",
+            f"延迟: {rtt:.0f} ms" if rtt is not None else "延迟: -",
+            f"下行: {metrics['kbps_in']:.1f} kbps",
+            f"快照: {metrics['avg_snapshot_bytes']:.0f} 字节",
+        ]
+        for i, line in enumerate(lines):
+            screen.blit(font.render(line, True, WHITE), (GAME_WIDTH + 10, 20 + i * 30))
+        if client.result is not None:
+            text, color = ("恭喜通关!", GREEN) if client.result == Simulation.VICTORY else ("游戏结束!", RED)
+            label = big_font.render(text, True, color)
+            screen.blit(label, label.get_rect(center=(WINDOW_WIDTH // 2, WINDOW_HEIGHT // 2)))
+        pygame.display.flip()
+        clock.tick(60)
+        await asyncio.sleep(0)  # 让出事件循环处理网络收发
+    await client.close()
+    pygame.quit()
+
+
+async def run_loopback(level_data, clients=3, seconds=5.0, seed=0, snapshot_every=1):
+    """在本机回环上启动服务器和若干无界面客户端，控制玩家的客户端随机移动，返回各方统计"""
+    server = NetServer(level_data, port=0, snapshot_every=snapshot_every)
+    await server.start()
+    peers = []
+    for _ in range(clients):
+        client = NetClient()
+        await client.connect('127.0.0.1', server.port)
+        peers.append(client)
+
+    rng = random.Random(seed)
+    action = (0, 0)
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        if rng.random() < 0.05:
+            action = (rng.randint(-1, 1), rng.randint(-1, 1))
+        for client in peers:
+            if client.controller:
+                client.send_input(*action)
+        await asyncio.sleep(FRAME_MS / 1000)
+
+    # 暂停推进，等最后的快照到达后核对客户端镜像与服务器状态一致
+    server.loop_task.cancel()
+    await asyncio.sleep(0.2)
+    expected = {i: list(state) for i, state in enumerate(server.states)}
+    consistent = all(client.entities == expected for client in peers)
+    result = {
+        'server': server.metrics(),
+        'clients': [client.metrics() for client in peers],
+        'consistent': consistent,
+    }
+    for client in peers:
+        await client.close()
+    await server.stop()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="迷宫探险联机模式")
+    parser.add_argument('mode', choices=['server', 'client', 'loopback'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--level', type=int, default=1, help="服务器使用的关卡，超出预定义关卡时随机生成")
+    parser.add_argument('--snapshot-every', type=int, default=1, help="每几个 tick 发送一次快照")
+    parser.add_argument('--clients', type=int, default=3, help="回环测试的客户端数量")
+    parser.add_argument('--seconds', type=float, default=5.0, help="回环测试时长")
+    args = parser.parse_args()
+
+    levels = Game._load_predefined_levels()
+    level_data = levels[args.level - 1] if args.level <= len(levels) else MazeGenerator.generate_random_level()
+
+    if args.mode == 'server':
+        async def serve():
+            server = NetServer(level_data, args.host, args.port, args.snapshot_every)
+            await server.start()
+            print(f"服务器已启动: {args.host}:{server.port}")
+            while True:
+                await asyncio.sleep(5)
+                print(server.metrics())
+        asyncio.run(serve())
+    elif args.mode == 'client':
+        asyncio.run(run_window_client(args.host, args.port))
+    else:
+        result = asyncio.run(run_loopback(level_data, args.clients, args.seconds, snapshot_every=args.snapshot_every))
+        print(f"服务器: {result['server']}")
+        for metrics in result['clients']:
+            print(f"客户端: {metrics}")
+        print(f"客户端状态与服务器一致: {result['consistent']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""关卡包工具：把关卡打包成可按编号随机访问的 .mzp 文件，或查看已有关卡包
+
+用法：
+    python pack_levels.py build levels.mzp                          # 打包预定义关卡
+    python pack_levels.py build levels.mzp my_levels/ a.json --random 1000 --seed 0
+    python pack_levels.py info levels.mzp
+    python pack_levels.py show levels.mzp 42                        # 输出第 42 关的 JSON
+"""
+import argparse
+import json
+import os
+import random
+
+from main import LEVEL_PACK_ZLIB, Game, LevelPack, MazeGenerator
+
+
+def iter_sources(paths, random_count=0, seed=0):
+    """依次产出关卡数据：JSON 文件、目录中的 JSON 文件、其他关卡包，最后是随机关卡；不指定时使用预定义关卡"""
+    if not paths and not random_count:
+        yield from Game._load_predefined_levels()
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.json'):
+                    with open(os.path.join(path, name), encoding='utf-8') as f:
+                        yield json.load(f)
+        elif path.endswith('.mzp'):
+            with LevelPack(path) as pack:
+                yield from pack
+        else:
+            with open(path, encoding='utf-8') as f:
+                yield json.load(f)
+    for i in range(random_count):
+        yield MazeGenerator.generate_random_level(rng=random.Random(seed + i))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="关卡包工具")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="打包关卡")
+    build.add_argument('output')
+    build.add_argument('sources', nargs='*', help="JSON 文件、包含 JSON 的目录或其他关卡包")
+    build.add_argument('--random', type=int, default=0, help="追加的随机关卡数量")
+    build.add_argument('--seed', type=int, default=0)
+    build.add_argument('--no-compress', action='store_true', help="不压缩关卡数据")
+    info = commands.add_parser('info', help="查看关卡包概况")
+    info.add_argument('pack')
+    show = commands.add_parser('show', help="输出某一关的 JSON")
+    show.add_argument('pack')
+    show.add_argument('level', type=int, help="关卡编号，从 1 开始")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        count = LevelPack.write(args.output, iter_sources(args.sources, args.random, args.seed),
+                                compress=not args.no_compress)
+        print(f"已写入 {count} 关到 {args.output}（{os.path.getsize(args.output)} 字节）")
+    elif args.command == 'info':
+        with LevelPack(args.pack) as pack:
+            # 流式遍历，内存占用与关卡数无关
+            obstacles = sum(len(level_data.get('obstacles', [])) for level_data in pack)
+            print(f"{args.pack}: {len(pack)} 关，共 {obstacles} 个障碍物，"
+                  f"{'zlib 压缩' if pack.flags & LEVEL_PACK_ZLIB else '未压缩'}，{os.path.getsize(args.pack)} 字节")
+    else:
+        with LevelPack(args.pack) as pack:
+            print(json.dumps(pack[args.level - 1], ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()